@@ -0,0 +1,52 @@
+"""
+Check that the three copies of metrics.py have not drifted apart.
+
+grimoire-guardian, stormy-mcweatherface and git-happens are installed on their
+own, so each ships its own metrics.py. The copies must be identical apart from
+the `METRICS = Metrics(...)` line that sets the namespace. Any other difference
+is printed as a diff and the script fails, so it can guard the copies in CI:
+
+    python benchmarks/check_metrics.py
+"""
+import difflib
+import pathlib
+import re
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+COPIES = [
+    "grimoire-guardian/src/grimoire_guardian/metrics.py",
+    "stormy-mcweatherface/src/stormy_mcweatherface/metrics.py",
+    "git-happens/src/git_happens/metrics.py",
+]
+
+NAMESPACE = re.compile(r'^METRICS = Metrics\("\w+"\)$', re.M)
+
+
+def read(path: str) -> list[str]:
+    text = (ROOT / path).read_text()
+    text, n = NAMESPACE.subn('METRICS = Metrics("<namespace>")', text)
+    if n != 1:
+        raise SystemExit(f"{path}: expected one METRICS = Metrics(...) line, found {n}")
+    return text.splitlines(keepends=True)
+
+
+def main() -> int:
+    first, *others = COPIES
+    expected = read(first)
+    failed = False
+    for path in others:
+        diff = list(difflib.unified_diff(expected, read(path), first, path))
+        if diff:
+            failed = True
+            sys.stdout.writelines(diff)
+    if failed:
+        print("metrics.py copies differ, change all of them together", file=sys.stderr)
+        return 1
+    print(f"{len(COPIES)} copies of metrics.py match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
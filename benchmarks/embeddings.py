@@ -0,0 +1,167 @@
+"""
+Embedding backend benchmark for Grimoire Guardian.
+
+Embeds the chunks of a document with every backend in
+`grimoire_guardian.embeddings` and compares them to the HuggingFace
+embeddings in half precision that Grimoire Guardian used before. For each
+backend it reports
+
+- the time to load the model,
+- the throughput embedding the chunks, in chunks and estimated tokens per second,
+- the latency of embedding a single query,
+- the parity with the baseline: the cosine similarity of the chunk vectors,
+  and the overlap of the top k search results of the queries.
+
+Run it in the environment of grimoire-guardian:
+
+    uv run --project grimoire-guardian --extra onnx python benchmarks/embeddings.py
+    uv run --project grimoire-guardian python benchmarks/embeddings.py book.pdf --backends torch torch-int8
+
+Queries are read from `--queries`, one per line, or else a sentence is taken
+from each of a sample of the chunks.
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import time
+
+import numpy as np
+
+BASELINE = "huggingface-fp16"
+
+
+def load_baseline(model_name: str):
+    """
+    Return the HuggingFace embeddings as Grimoire Guardian created them before.
+    """
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"model_kwargs": {"torch_dtype": torch.float16}},
+        encode_kwargs={"normalize_embeddings": False, "batch_size": 16},
+    )
+
+
+def sample_queries(texts: list[str], n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    queries = []
+    for text in rng.sample(texts, min(n, len(texts))):
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 5]
+        if sentences:
+            queries.append(rng.choice(sentences))
+    return queries
+
+
+def unit(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def topk(docs: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # the index ranks by L2 distance
+    d = (queries**2).sum(1)[:, None] - 2 * queries @ docs.T + (docs**2).sum(1)[None, :]
+    return np.argsort(d, axis=1)[:, :k]
+
+
+def run(name: str, embedder, texts: list[str], queries: list[str], load_s: float) -> dict:
+    from grimoire_guardian.ingest import estimate_tokens
+
+    tokens = sum(estimate_tokens(t, 512) for t in texts)
+    # warm up, the first batch pays for lazy initialization
+    embedder.embed_documents(texts[:8])
+
+    start = time.perf_counter()
+    docs = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+    seconds = time.perf_counter() - start
+
+    latencies = []
+    vectors = []
+    for q in queries:
+        start = time.perf_counter()
+        vectors.append(embedder.embed_query(q))
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    return {
+        "backend": name,
+        "load_s": load_s,
+        "chunks_per_s": len(texts) / seconds,
+        "tokens_per_s": tokens / seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "docs": docs,
+        "queries": np.asarray(vectors, dtype=np.float32),
+    }
+
+
+def parity(result: dict, baseline: dict, k: int) -> dict:
+    cos = (unit(result["docs"]) * unit(baseline["docs"])).sum(1)
+    ours = topk(result["docs"], result["queries"], k)
+    theirs = topk(baseline["docs"], baseline["queries"], k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ours, theirs)]
+    return {
+        "cosine_mean": float(cos.mean()),
+        "cosine_min": float(cos.min()),
+        f"overlap@{k}": statistics.mean(overlap) if overlap else None,
+    }
+
+
+def main(argv=None) -> int:
+    import grimoire_guardian
+    from grimoire_guardian import embeddings
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("doc", nargs="?", default=grimoire_guardian.DOC, help="document to embed")
+    parser.add_argument("--backends", nargs="+", default=list(embeddings.BACKENDS), choices=embeddings.BACKENDS)
+    parser.add_argument("--model", default=grimoire_guardian.MODEL_EMB)
+    parser.add_argument("--threads", type=int, help="threads used by the backends, defaults to all cores")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, help="embed at most this many chunks")
+    parser.add_argument("--queries", help="file with one query per line")
+    parser.add_argument("-k", type=int, default=10, help="search results compared for parity")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    texts = [c.page_content for c in grimoire_guardian.load_chunks(args.doc)][: args.limit]
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(texts, 100)
+    print(f"{len(texts)} chunks, {len(queries)} queries", file=sys.stderr)
+
+    results = []
+    for name in [BASELINE, *args.backends]:
+        print(f"running {name}", file=sys.stderr)
+        start = time.perf_counter()
+        if name == BASELINE:
+            embedder = load_baseline(args.model)
+        else:
+            embedder = embeddings.Embedder(args.model, name, threads=args.threads, batch_size=args.batch_size)
+        results.append(run(name, embedder, texts, queries, time.perf_counter() - start))
+        del embedder
+
+    baseline = results[0]
+    rows = []
+    for r in results:
+        row = {k: v for k, v in r.items() if k not in ("docs", "queries")}
+        row.update(parity(r, baseline, args.k))
+        rows.append(row)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+    cols = ["backend", "load_s", "chunks_per_s", "tokens_per_s", "query_p50_ms", "query_p99_ms", "cosine_mean", "cosine_min", f"overlap@{args.k}"]
+    print("  ".join(f"{c:>16}" for c in cols))
+    for row in rows:
+        print("  ".join(f"{row[c]:>16.3f}" if isinstance(row[c], float) else f"{row[c]:>16}" for c in cols))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
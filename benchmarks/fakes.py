@@ -0,0 +1,352 @@
+"""
+Local stand-ins for the services the samples talk to.
+
+- `ChatServer`: an OpenAI compatible chat completions endpoint. Responses are
+  scripted, streamed as server-sent events when asked to, and delayed by a
+  configurable time to first token and time per chunk.
+- `NominatimServer`: geocodes any query to stable coordinates in Norway.
+- `MetServer`: met.no locationforecast responses with Expires and
+  Last-Modified headers, and 304s for conditional requests.
+
+Every server listens on a free port on localhost and runs in a background
+thread:
+
+    with ChatServer(latency=0.2) as chat:
+        client = openai.OpenAI(base_url=chat.url, api_key="fake")
+"""
+import datetime
+import email.utils
+import hashlib
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable
+
+
+def _hash(text: str) -> float:
+    """
+    Return a stable number in [0, 1) for the text.
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little") / 2**64
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # many clients connect at once under load
+    request_queue_size = 256
+
+
+class FakeServer:
+    """
+    Threaded HTTP server on a free localhost port, counting the requests it serves.
+    """
+
+    def __init__(self, handler: type[http.server.BaseHTTPRequestHandler], latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = _Server(("127.0.0.1", 0), handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def send_json(self, status: int, body: Any, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+#
+# Chat completions
+#
+
+def last_user_message(messages: list[dict]) -> tuple[str, list[dict]]:
+    """
+    Return the text of the last user message and the messages after it.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            content = messages[i].get("content") or ""
+            if isinstance(content, list):
+                content = " ".join(c.get("text", "") for c in content if isinstance(c, dict))
+            return content, messages[i + 1 :]
+    return "", messages
+
+
+def call_first_tool(messages: list[dict], tools: list[dict]) -> dict:
+    """
+    Default script: call the first tool once with the user message as every
+    required argument, then answer.
+    """
+    query, after = last_user_message(messages)
+    if tools and not any(m.get("role") == "tool" for m in after):
+        fn = tools[0]["function"]
+        required = fn.get("parameters", {}).get("required", [])
+        return {"tool_calls": [(fn["name"], {k: query for k in required})]}
+    return {"content": f"Here is what I found about {query}. " * 4}
+
+
+class ChatServer(FakeServer):
+    """
+    OpenAI compatible chat completions server.
+
+    `script` is called with the messages and tools of each request and returns
+    {"content": text} or {"tool_calls": [(name, arguments), ...]}. `latency` is
+    the time to the first token and `chunk_latency` the time between streamed
+    chunks.
+    """
+
+    def __init__(
+        self,
+        script: Callable[[list[dict], list[dict]], dict] = call_first_tool,
+        latency: float = 0.0,
+        chunk_latency: float = 0.0,
+        chunks: int = 8,
+    ):
+        super().__init__(ChatHandler, latency)
+        self.script = script
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self._ids = itertools.count()
+
+    def next_id(self) -> str:
+        with self._lock:
+            return f"call_{next(self._ids)}"
+
+
+class ChatHandler(Handler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        self.fake.count()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        messages = body.get("messages", [])
+        reply = self.fake.script(messages, body.get("tools") or [])
+
+        tool_calls = [
+            {"id": self.fake.next_id(), "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+            for name, args in reply.get("tool_calls", [])
+        ]
+        content = reply.get("content")
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4 + 1
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content or "") // 4 + 8 * len(tool_calls),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion = {
+            "id": f"chatcmpl-{self.fake.next_id()}",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+
+        time.sleep(self.fake.latency)
+        if body.get("stream"):
+            self.stream(completion, content, tool_calls, usage, body.get("stream_options") or {})
+            return
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        self.send_json(200, {
+            **completion,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }],
+            "usage": usage,
+        })
+
+    def stream(self, completion: dict, content: str | None, tool_calls: list, usage: dict, options: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # the end of the stream is the end of the connection
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(choices, **extra):
+            chunk = {**completion, "object": "chat.completion.chunk", "choices": choices, **extra}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        def delta(d, finish=None):
+            send([{"index": 0, "delta": d, "finish_reason": finish}])
+            time.sleep(self.fake.chunk_latency)
+
+        delta({"role": "assistant", "content": ""})
+        if content:
+            words = content.split(" ")
+            n = max(1, len(words) // self.fake.chunks)
+            for i in range(0, len(words), n):
+                piece = " ".join(words[i : i + n])
+                delta({"content": piece if i == 0 else " " + piece})
+        for i, tc in enumerate(tool_calls):
+            args = tc["function"]["arguments"]
+            delta({"tool_calls": [{
+                "index": i, "id": tc["id"], "type": "function",
+                "function": {"name": tc["function"]["name"], "arguments": ""},
+            }]})
+            half = len(args) // 2
+            for part in (args[:half], args[half:]):
+                delta({"tool_calls": [{"index": i, "function": {"arguments": part}}]})
+        send([{"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_calls else "stop"}])
+        if options.get("include_usage"):
+            send([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+#
+# Nominatim
+#
+
+class NominatimServer(FakeServer):
+    """
+    Nominatim search stub, queries containing "nowhere" are not found.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(NominatimHandler, latency)
+
+
+class NominatimHandler(Handler):
+    def do_GET(self):
+        self.fake.count()
+        url = urllib.parse.urlsplit(self.path)
+        q = urllib.parse.parse_qs(url.query).get("q", [""])[0]
+        time.sleep(self.fake.latency)
+        if "nowhere" in q.lower():
+            self.send_json(200, [])
+            return
+        # somewhere in southern Norway
+        lat = 58.0 + 5.0 * _hash(q)
+        lon = 5.0 + 7.0 * _hash(q[::-1])
+        self.send_json(200, [{
+            "display_name": f"{q}, Norge",
+            "lat": f"{lat:.7f}",
+            "lon": f"{lon:.7f}",
+            "address": {"country": "Norge", "country_code": "no"},
+        }])
+
+
+#
+# met.no
+#
+
+def forecast(lat: float, lon: float, hours: int = 90) -> dict:
+    """
+    Return a locationforecast response shaped like met.no's, hourly for the
+    first two days and six hourly after that.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    seed = _hash(f"{lat:.2f},{lon:.2f}")
+    timeseries = []
+    t = now
+    for i in range(hours):
+        step = 1 if i < 48 else 6
+        period = "next_1_hours" if step == 1 else "next_6_hours"
+        rain = max(0.0, round(2 * (_hash(f"{seed}{i}") - 0.6), 1))
+        timeseries.append({
+            "time": t.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "data": {
+                "instant": {"details": {
+                    "air_temperature": round(5 + 10 * seed + 4 * ((i % 24) / 24 - 0.5), 1),
+                    "wind_speed": round(1 + 8 * _hash(f"w{seed}{i}"), 1),
+                    "wind_from_direction": round(360 * _hash(f"d{seed}{i}"), 1),
+                    "relative_humidity": round(50 + 50 * _hash(f"h{seed}{i}"), 1),
+                    "cloud_area_fraction": round(100 * _hash(f"c{seed}{i}"), 1),
+                    "air_pressure_at_sea_level": round(990 + 40 * seed, 1),
+                }},
+                period: {
+                    "summary": {"symbol_code": "rain" if rain else "partlycloudy_day"},
+                    "details": {"precipitation_amount": rain},
+                },
+            },
+        })
+        t += datetime.timedelta(hours=step)
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat, 0]},
+        "properties": {"meta": {"updated_at": now.strftime("%Y-%m-%dT%H:%M:%SZ")}, "timeseries": timeseries},
+    }
+
+
+class MetServer(FakeServer):
+    """
+    met.no locationforecast stub, forecasts expire after `ttl` seconds.
+    """
+
+    def __init__(self, latency: float = 0.0, ttl: float = 1800):
+        super().__init__(MetHandler, latency)
+        self.ttl = ttl
+        self.modified = email.utils.formatdate(usegmt=True)
+
+
+class MetHandler(Handler):
+    def do_GET(self):
+        self.fake.count()
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        time.sleep(self.fake.latency)
+        try:
+            lat, lon = float(params["lat"][0]), float(params["lon"][0])
+        except (KeyError, ValueError):
+            self.send_json(400, {"error": "lat and lon are required"})
+            return
+        headers = {
+            "Expires": email.utils.formatdate(time.time() + self.fake.ttl, usegmt=True),
+            "Last-Modified": self.fake.modified,
+        }
+        if self.headers.get("If-Modified-Since") == self.fake.modified:
+            self.send_response(304)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_json(200, forecast(lat, lon), headers)
@@ -0,0 +1,144 @@
+"""
+Local stand-in for the GitHub MCP server.
+
+Serves a few of the GitHub MCP server's tools, with the same names and
+arguments, over an in-memory set of repositories, and delays every call to
+mimic the GitHub API. Writes are visible to later reads, so stale cached
+results show up as wrong answers.
+
+Run it over stdio, the way git-happens starts the real server in docker, or
+over HTTP to use with `GITHUB_MCP_URL`:
+
+    python benchmarks/github_mcp.py
+    python benchmarks/github_mcp.py --transport streamable-http --port 8765
+    GITHUB_MCP_URL=http://127.0.0.1:8765/mcp uv run git-happens
+"""
+import argparse
+import json
+import time
+
+from mcp.server.fastmcp import FastMCP
+
+server = FastMCP("fake-github", log_level="WARNING")
+
+LATENCY = 0.05
+
+REPOS = {
+    ("octo", "hello-world"): {
+        "description": "My first repository on GitHub",
+        "issues": [
+            {"number": 1, "title": "Found a bug", "state": "open", "body": "It crashes on start"},
+            {"number": 2, "title": "Add a license", "state": "closed", "body": "MIT please"},
+        ],
+        "pulls": [{"number": 3, "title": "Fix the crash on start", "state": "open", "head": "fix-crash"}],
+        "files": {"README.md": "# Hello World\n", "main.py": "print('hello world')\n"},
+    },
+    ("octo", "spoon-knife"): {
+        "description": "This repo is for demonstration purposes only",
+        "issues": [{"number": 1, "title": "Fork me", "state": "open", "body": "Please"}],
+        "pulls": [],
+        "files": {"README.md": "# Spoon-Knife\n", "index.html": "<h1>Hello</h1>\n"},
+    },
+}
+
+
+def repository(owner: str, repo: str) -> dict:
+    try:
+        return REPOS[owner.lower(), repo.lower()]
+    except KeyError:
+        raise ValueError(f"failed to get repository: {owner}/{repo} not found") from None
+
+
+def api():
+    # every tool call is a GitHub API request
+    time.sleep(LATENCY)
+
+
+@server.tool()
+def get_me() -> str:
+    """Get details of the authenticated GitHub user."""
+    api()
+    return json.dumps({"login": "octo", "name": "Octo Cat"})
+
+
+@server.tool()
+def search_repositories(query: str) -> str:
+    """Search for GitHub repositories."""
+    api()
+    items = [
+        {"full_name": f"{o}/{r}", "description": d["description"]}
+        for (o, r), d in REPOS.items()
+        if query.lower() in f"{o}/{r} {d['description']}".lower()
+    ]
+    return json.dumps({"total_count": len(items), "items": items})
+
+
+@server.tool()
+def list_issues(owner: str, repo: str, state: str = "open") -> str:
+    """List issues in a GitHub repository."""
+    api()
+    issues = repository(owner, repo)["issues"]
+    return json.dumps([i for i in issues if state == "all" or i["state"] == state])
+
+
+@server.tool()
+def get_issue(owner: str, repo: str, issue_number: int) -> str:
+    """Get details of a specific issue in a GitHub repository."""
+    api()
+    for issue in repository(owner, repo)["issues"]:
+        if issue["number"] == issue_number:
+            return json.dumps(issue)
+    raise ValueError(f"failed to get issue: #{issue_number} not found")
+
+
+@server.tool()
+def create_issue(owner: str, repo: str, title: str, body: str = "") -> str:
+    """Create a new issue in a GitHub repository."""
+    api()
+    r = repository(owner, repo)
+    issue = {"number": 1 + max((i["number"] for i in r["issues"] + r["pulls"]), default=0),
+             "title": title, "state": "open", "body": body}
+    r["issues"].append(issue)
+    return json.dumps(issue)
+
+
+@server.tool()
+def list_pull_requests(owner: str, repo: str, state: str = "open") -> str:
+    """List pull requests in a GitHub repository."""
+    api()
+    pulls = repository(owner, repo)["pulls"]
+    return json.dumps([p for p in pulls if state == "all" or p["state"] == state])
+
+
+@server.tool()
+def get_file_contents(owner: str, repo: str, path: str) -> str:
+    """Get the contents of a file from a GitHub repository."""
+    api()
+    files = repository(owner, repo)["files"]
+    if path not in files:
+        raise ValueError(f"failed to get file contents: {path} not found")
+    return files[path]
+
+
+@server.tool()
+def create_or_update_file(owner: str, repo: str, path: str, content: str, message: str) -> str:
+    """Create or update a single file in a GitHub repository."""
+    api()
+    repository(owner, repo)["files"][path] = content
+    return json.dumps({"path": path, "message": message})
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--transport", choices=["stdio", "streamable-http", "sse"], default="stdio")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds per GitHub API call")
+    args = parser.parse_args()
+    LATENCY = args.latency
+    server.settings.port = args.port
+    server.run(args.transport)
+
+
+if __name__ == "__main__":
+    main()
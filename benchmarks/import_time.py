@@ -0,0 +1,137 @@
+"""
+Cold start benchmark, how long it takes to import each package.
+
+Every import runs in a fresh interpreter with `-X importtime`, which reports
+the time spent in every module imported. The median wall time over a number of
+runs is reported per package, together with the slowest modules and any heavy
+dependency that was loaded even though it should only be imported on first use.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --python grimoire-guardian/.venv/bin/python grimoire_guardian
+    python benchmarks/import_time.py --budget 0.5
+
+With `--budget` the script fails if any package takes longer than that many
+seconds to import, so it can guard cold starts in CI.
+"""
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# module -> project directory holding its source
+MODULES = {
+    "grimoire_guardian": "grimoire-guardian",
+    "git_happens": "git-happens",
+    "stormy_mcweatherface": "stormy-mcweatherface",
+    "stormy_mcweatherface.batch": "stormy-mcweatherface",
+}
+
+# dependencies that take a second or more to import and so should not be
+# loaded by importing a package
+HEAVY = [
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "langchain",
+    "langgraph",
+    "langchain_unstructured",
+    "streamlit",
+    "gradio",
+    "mlflow",
+    "openai",
+    "databricks.sdk",
+    "smolagents",
+    "mcp",
+]
+
+# prints the heavy modules loaded after the import
+PROBE = "import sys, json; import {module}; print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """
+    Parse the output of `-X importtime` into (module, self us, cumulative us).
+    """
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        out.append((name.strip(), int(self_us), int(cumulative)))
+    return out
+
+
+def measure(python: str, module: str, runs: int = 5) -> dict:
+    """
+    Import the module in `runs` fresh interpreters and summarize the timings.
+    """
+    env = dict(os.environ)
+    src = ROOT / MODULES.get(module, module.split(".")[0]) / "src"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(src), env.get("PYTHONPATH")]))
+    cmd = [python, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY)]
+
+    walls = []
+    modules = []
+    heavy = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        p = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if p.returncode != 0:
+            return {"module": module, "error": p.stderr.strip().splitlines()[-1]}
+        # the first run only warms the bytecode cache
+        if i == 0:
+            continue
+        walls.append(wall)
+        modules = parse_importtime(p.stderr)
+        heavy = json.loads(p.stdout.strip().splitlines()[-1])
+
+    cumulative = {name: c for name, _, c in modules}
+    slowest = sorted(modules, key=lambda m: m[1], reverse=True)[:10]
+    return {
+        "module": module,
+        "wall_s": statistics.median(walls),
+        "import_s": cumulative.get(module, 0) / 1e6,
+        "modules": len(modules),
+        "heavy": heavy,
+        "slowest": [{"module": n, "self_ms": s / 1e3, "cumulative_ms": c / 1e3} for n, s, c in slowest],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=list(MODULES), help="modules to import")
+    parser.add_argument("--python", default=sys.executable, help="interpreter with the dependencies installed")
+    parser.add_argument("--runs", type=int, default=5, help="imports per module, the median is reported")
+    parser.add_argument("--budget", type=float, help="fail if an import takes longer than this many seconds")
+    parser.add_argument("--json", action="store_true", help="print the full results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [measure(args.python, m, args.runs) for m in args.modules]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            if "error" in r:
+                print(f"{r['module']:30} failed: {r['error']}")
+                continue
+            print(f"{r['module']:30} {r['wall_s']:6.3f}s wall  {r['import_s']:6.3f}s import  {r['modules']:5} modules")
+            if r["heavy"]:
+                print(f"{'':30} heavy dependencies loaded: {', '.join(r['heavy'])}")
+            for m in r["slowest"][:5]:
+                print(f"{'':30}   {m['self_ms']:8.1f}ms  {m['module']}")
+
+    failed = [r for r in results if "error" in r]
+    if args.budget is not None:
+        failed += [r for r in results if r.get("wall_s", 0) > args.budget]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+Offline end-to-end load benchmarks.
+
+Every benchmark runs against the local stand-ins in `fakes.py` and
+`github_mcp.py` instead of the Databricks serving endpoint, Nominatim, met.no
+and GitHub, so results only change when the code does. Requests are sent from `--concurrency` threads and the report
+holds the throughput, the p50/p95/p99 latency, the errors, the requests made to
+the fake services and the peak memory of the process.
+
+Run each benchmark in the environment of its project:
+
+    uv run --project stormy-mcweatherface python benchmarks/load.py stormy --requests 200 --concurrency 16
+    uv run --project grimoire-guardian python benchmarks/load.py grimoire --requests 100 --concurrency 8
+    uv run --project grimoire-guardian python benchmarks/load.py index --docs 8 --concurrency 2
+    uv run --project git-happens python benchmarks/load.py github --requests 500 --cache
+
+`--latency` sets the time to first token of the fake LLM. The Grimoire
+benchmarks embed with a hashing embedder unless `--embeddings model` is given,
+which loads the real embedding model.
+"""
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterable
+
+import numpy as np
+
+import fakes
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def drive(fn: Callable[[Any], Any], inputs: Iterable, concurrency: int) -> dict:
+    """
+    Call `fn` on every input from `concurrency` threads and summarize the latencies.
+    """
+    latencies = []
+    errors = []
+
+    def call(x):
+        start = time.perf_counter()
+        try:
+            fn(x)
+        except Exception as e:
+            errors.append(repr(e))
+            return
+        latencies.append(time.perf_counter() - start)
+
+    inputs = list(inputs)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(call, inputs))
+    wall = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": len(inputs),
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)) if len(ms) else None,
+        "p95_ms": float(np.percentile(ms, 95)) if len(ms) else None,
+        "p99_ms": float(np.percentile(ms, 99)) if len(ms) else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+WORDS = (
+    "the wizard castle owl letter wand potion forest dragon stone mirror cloak "
+    "train platform staircase portrait ghost troll dungeon library feast match "
+    "broom snitch keeper seeker garden window chamber corridor dormitory lesson "
+    "walked found whispered opened carried watched remembered hurried laughed "
+    "quietly suddenly slowly never always again under over behind across"
+).split()
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def paragraphs(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(sentence(rng) for _ in range(rng.randint(4, 9))) for _ in range(n)]
+
+
+#
+# Stormy McWeatherface
+#
+
+LOCATIONS = [
+    "Oslo", "Bergen", "Trondheim", "Stavanger", "Tromsø", "Kristiansand", "Drammen",
+    "Fredrikstad", "Bodø", "Ålesund", "Lillehammer", "Hamar", "Molde", "Narvik",
+    "Biskop Gunnerus gate 14", "Karl Johans gate 1", "Youngstorget 3", "Bryggen 1",
+]
+
+
+def weather_script(messages: list[dict], tools: list[dict]) -> dict:
+    """
+    Geocode the location in the question, get the weather there and answer.
+    """
+    query, after = fakes.last_user_message(messages)
+    results = [m for m in after if m.get("role") == "tool"]
+    if not tools:
+        return {"content": f"The weather in {query} is fine."}
+    if not results:
+        location = query.rsplit(" in ", 1)[-1].rstrip("?")
+        return {"tool_calls": [("get_geocode_location", {"location": location})]}
+    called = [tc["function"]["name"] for m in after for tc in m.get("tool_calls") or []]
+    last = json.loads(results[-1]["content"])
+    if called[-1] == "get_geocode_location" and last.get("success"):
+        return {"tool_calls": [("get_weather", {"lat": str(last["latitude"]), "lon": str(last["longitude"])})]}
+    return {"content": "It is partly cloudy with a chance of rain, bring an umbrella and go for a walk. " * 3}
+
+
+def bench_stormy(args) -> dict:
+    # keep the caches of the run apart from the user's
+    os.environ["STORMY_CACHE_DIR"] = tempfile.mkdtemp(prefix="stormy-bench-")
+
+    import mlflow
+    import openai
+    from mlflow.types.responses import ResponsesAgentRequest
+
+    from stormy_mcweatherface import clients, stormy, weather
+
+    mlflow.tracing.disable()
+
+    with (
+        fakes.ChatServer(weather_script, latency=args.latency, chunk_latency=args.chunk_latency) as chat,
+        fakes.NominatimServer(latency=args.service_latency) as nominatim,
+        fakes.MetServer(latency=args.service_latency) as met,
+    ):
+        weather.NOMINATIM_URL = f"{nominatim.url}/search"
+        weather.MET_URL = f"{met.url}/weatherapi/locationforecast/2.0/compact"
+        # the stub has no usage policy to respect
+        weather.NOMINATIM_LIMITER = clients.RateLimiter(1e6)
+
+        client = openai.OpenAI(base_url=chat.url, api_key="fake", max_retries=0)
+        pool = stormy.AgentPool(
+            args.concurrency, client=client, planner=args.planner, cache=stormy.RESPONSE_CACHE if args.cache else None
+        )
+
+        def ask(location):
+            request = ResponsesAgentRequest(
+                input=[{"role": "user", "content": f"What is the weather like in {location}?"}]
+            )
+            with pool.agent() as agent:
+                response = agent.predict(request)
+            if response.output[-1].type != "message":
+                raise RuntimeError("no answer")
+
+        rng = random.Random(0)
+        locations = [rng.choice(LOCATIONS[: args.locations]) for _ in range(args.requests)]
+        report = drive(ask, locations, args.concurrency)
+        report["llm_requests"] = chat.requests
+        report["nominatim_requests"] = nominatim.requests
+        report["met_requests"] = met.requests
+    return report
+
+
+#
+# Grimoire Guardian
+#
+
+class HashEmbeddings:
+    """
+    Hashed bag of words embeddings, no model and no network needed.
+    """
+
+    max_seq_length = 256
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts: list[str], batch_size: int | None = None) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for w in text.lower().split():
+                h = int.from_bytes(hashlib.blake2b(w.encode(), digest_size=4).digest(), "little")
+                out[i, h % self.dim] += 1.0
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
+
+
+def setup_grimoire(args, chat=None):
+    """
+    Point Grimoire Guardian at the fake LLM and, unless asked for the real
+    model, the hashing embedder.
+    """
+    os.environ["GRIMOIRE_CACHE_DIR"] = tempfile.mkdtemp(prefix="grimoire-bench-")
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    import grimoire_guardian
+    from grimoire_guardian import ingest
+
+    if args.embeddings == "hash":
+        from langchain_core.embeddings import Embeddings
+
+        # langchain is only installed for grimoire, so it is mixed in here
+        embedder = type("HashEmbedder", (HashEmbeddings, Embeddings), {})()
+        grimoire_guardian.get_embedder = ingest.get_embedder = lambda: embedder
+    if chat is not None:
+        import openai
+
+        client = openai.OpenAI(base_url=chat.url, api_key="fake", max_retries=0)
+        grimoire_guardian.get_client = lambda: client
+    return grimoire_guardian
+
+
+def write_docs(n: int, size: int) -> list[str]:
+    root = tempfile.mkdtemp(prefix="grimoire-docs-")
+    docs = []
+    for i in range(n):
+        path = os.path.join(root, f"doc-{i}.txt")
+        with open(path, "w") as f:
+            f.write("\n\n".join(paragraphs(size, seed=i)))
+        docs.append(path)
+    return docs
+
+
+def bench_grimoire(args) -> dict:
+    with fakes.ChatServer(latency=args.latency, chunk_latency=args.chunk_latency) as chat:
+        grimoire_guardian = setup_grimoire(args, chat)
+        idx = grimoire_guardian.create_index(write_docs(1, args.paragraphs)[0], store=None)
+        g = grimoire_guardian.graph(idx, cache=grimoire_guardian.ANSWER_CACHE if args.cache else None)
+
+        def ask(q):
+            state = g.invoke({"query": q})
+            if not state["messages"][-1].content:
+                raise RuntimeError("no answer")
+
+        rng = random.Random(1)
+        questions = [f"What happened when {sentence(rng).lower().rstrip('.')}?" for _ in range(args.requests)]
+        report = drive(ask, questions, args.concurrency)
+        report["llm_requests"] = chat.requests
+    report["chunks"] = idx.index.ntotal
+    return report
+
+
+def bench_index(args) -> dict:
+    grimoire_guardian = setup_grimoire(args)
+    docs = write_docs(args.docs, args.paragraphs)
+    chunks = []
+
+    def build(doc):
+        chunks.append(grimoire_guardian.create_index(doc, store=None).index.ntotal)
+
+    report = drive(build, docs, args.concurrency)
+    report["chunks"] = sum(chunks)
+    report["chunks_per_s"] = sum(chunks) / report["wall_s"]
+    return report
+
+
+#
+# Git Happens
+#
+
+def github_calls(n: int, writes: float, seed: int = 2) -> list[tuple[str, dict]]:
+    """
+    Return a mix of GitHub tool calls, mostly reads, a fraction `writes` of writes.
+    """
+    repos = [{"owner": "octo", "repo": "hello-world"}, {"owner": "octo", "repo": "spoon-knife"}]
+    rng = random.Random(seed)
+    calls = []
+    for i in range(n):
+        r = rng.choice(repos)
+        if rng.random() < writes:
+            calls.append(rng.choice([
+                ("create_issue", {**r, "title": f"Issue {i}", "body": "Found while benchmarking"}),
+                ("create_or_update_file", {**r, "path": f"notes/{i}.md", "content": "note", "message": "Add note"}),
+            ]))
+            continue
+        calls.append(rng.choice([
+            ("get_me", {}),
+            ("search_repositories", {"query": "hello"}),
+            ("list_issues", {**r, "state": "open"}),
+            ("get_issue", {**r, "issue_number": 1}),
+            ("list_pull_requests", {**r, "state": "open"}),
+            ("get_file_contents", {**r, "path": "README.md"}),
+        ]))
+    return calls
+
+
+def bench_github(args) -> dict:
+    import mcp
+
+    import git_happens
+    from git_happens import session, toolcache
+
+    params = mcp.StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(os.path.dirname(__file__), "github_mcp.py"), "--latency", str(args.service_latency)],
+    )
+    session.GITHUB_MCP_URL = None
+    git_happens.get_params = lambda: params
+
+    upstream = collections.Counter()
+    cache = toolcache.ToolCache(ttl=toolcache.DEFAULT_TTL if args.cache else 0)
+    tools = {}
+    try:
+        for tool in session.get_tools():
+            forward = tool.forward
+
+            def counted(*a, _forward=forward, _name=tool.name, **kw):
+                upstream[_name] += 1
+                return _forward(*a, **kw)
+
+            tool.forward = counted
+            tools[tool.name] = toolcache.cached(tool, cache)
+
+        def call(c):
+            name, arguments = c
+            if not tools[name](**arguments):
+                raise RuntimeError(f"{name} returned nothing")
+
+        report = drive(call, github_calls(args.requests, args.writes), args.concurrency)
+    finally:
+        session.close()
+    report["mcp_requests"] = sum(upstream.values())
+    report.update({f"cache_{k}": v for k, v in cache.stats().items()})
+    return report
+
+
+BENCHMARKS = {"stormy": bench_stormy, "grimoire": bench_grimoire, "index": bench_index, "github": bench_github}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--requests", type=int, default=100, help="requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at a time")
+    parser.add_argument("--latency", type=float, default=0.1, help="time to first token of the fake LLM")
+    parser.add_argument("--chunk-latency", type=float, default=0.005, help="time between streamed chunks")
+    parser.add_argument("--service-latency", type=float, default=0.05, help="latency of Nominatim, met.no and GitHub")
+    parser.add_argument("--locations", type=int, default=len(LOCATIONS), help="distinct locations asked about")
+    parser.add_argument("--no-planner", dest="planner", action="store_false", help="let the LLM request every tool call")
+    parser.add_argument("--cache", action="store_true", help="use the semantic response/answer or tool result cache")
+    parser.add_argument("--embeddings", choices=["hash", "model"], default="hash", help="embedder for grimoire")
+    parser.add_argument("--docs", type=int, default=4, help="documents to index")
+    parser.add_argument("--writes", type=float, default=0.05, help="fraction of GitHub tool calls that write")
+    parser.add_argument("--paragraphs", type=int, default=300, help="paragraphs per document")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"benchmark": args.benchmark, **BENCHMARKS[args.benchmark](args)}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for k, v in report.items():
+            print(f"{k:20} {v:.3f}" if isinstance(v, float) else f"{k:20} {v}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
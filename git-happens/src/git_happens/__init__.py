@@ -1,41 +1,94 @@
-import smolagents
-import databricks.sdk
-import mcp
+import functools
 import os
 
+from . import metrics
+
 MODEL = "data-science-gpt-4o"
 
-wc = databricks.sdk.WorkspaceClient()
-client = wc.serving_endpoints.get_open_ai_client()
+# number of tools shown to the LLM per request, see `git_happens.routing`
+MAX_TOOLS = int(os.environ.get("GIT_HAPPENS_MAX_TOOLS", 8))
+
+# serving endpoint embedding tool descriptions for routing, keywords are used if not set
+EMBEDDING_MODEL = os.environ.get("GIT_HAPPENS_EMBEDDING_MODEL")
+
+
+@functools.cache
+def get_workspace_client():
+    import databricks.sdk
+
+    return databricks.sdk.WorkspaceClient()
+
+
+@functools.cache
+def get_client():
+    return get_workspace_client().serving_endpoints.get_open_ai_client()
+
+
+@functools.cache
+def get_model():
+    """
+    Return the model of the smolagents agent, created on the first call.
+    """
+    import smolagents
 
-# create a smolagents agent
-model = smolagents.OpenAIServerModel(
-    model_id=MODEL,
-    client=client,
-)
+    return smolagents.OpenAIServerModel(
+        model_id=MODEL,
+        client=get_client(),
+    )
 
-params = mcp.StdioServerParameters(
-    command="docker",
-    args=[
-        "run",
-        "-i",
-        "--rm",
-        "-e",
-        f"GITHUB_PERSONAL_ACCESS_TOKEN={os.environ['GITHUB_PERSONAL_ACCESS_TOKEN']}",
-        "ghcr.io/github/github-mcp-server",
-    ],
-)
+
+def get_params():
+    """
+    Return the parameters starting the GitHub MCP server in docker.
+    """
+    import mcp
+
+    return mcp.StdioServerParameters(
+        command="docker",
+        args=[
+            "run",
+            "-i",
+            "--rm",
+            "-e",
+            f"GITHUB_PERSONAL_ACCESS_TOKEN={os.environ['GITHUB_PERSONAL_ACCESS_TOKEN']}",
+            "ghcr.io/github/github-mcp-server",
+        ],
+    )
+
+
+# module attributes created on first access, importing the package loads
+# neither smolagents, mcp nor the databricks sdk
+_LAZY = {"wc": get_workspace_client, "client": get_client, "model": get_model, "params": get_params}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def main() -> None:
-    with smolagents.ToolCollection.from_mcp(
-        params, trust_remote_code=True
-    ) as tool_collection:
-        agent = smolagents.ToolCallingAgent(
-            tools=[*tool_collection.tools], model=model, add_base_tools=False
-        )
-        # create ui
-        ui = smolagents.GradioUI(
-            agent, file_upload_folder="uploads", reset_agent_memory=False
-        )
-        ui.launch()
+    import smolagents
+
+    from . import instrument, routing, session, toolcache
+
+    metrics.setup()
+    model = get_model()
+    instrument.instrument_model(model)
+    # the MCP session is kept open for the lifetime of the process, and read
+    # tool results are cached across conversations
+    tools = [instrument.instrument_tool(toolcache.cached(t)) for t in session.get_tools()]
+    embed = routing.embeddings(get_client(), EMBEDDING_MODEL) if EMBEDDING_MODEL else None
+    agent = routing.RoutedToolCallingAgent(
+        tools=tools,
+        model=model,
+        add_base_tools=False,
+        step_callbacks=[instrument.step_callback],
+        router=routing.ToolRouter(tools, embed=embed),
+        max_tools=MAX_TOOLS,
+    )
+    # create ui
+    ui = smolagents.GradioUI(
+        agent, file_upload_folder="uploads", reset_agent_memory=False
+    )
+    ui.launch()
@@ -0,0 +1,55 @@
+"""
+smolagents hooks feeding the metrics, see `metrics.py`.
+
+The agent's steps are recorded through a step callback, and tools and the
+model are wrapped so every call is timed.
+"""
+from .metrics import inc, observe, timed, timer
+
+
+def step_callback(step, agent=None):
+    """
+    smolagents step callback recording the duration and token usage of each step.
+    """
+    timing = getattr(step, "timing", None)
+    if timing is not None and timing.duration is not None:
+        observe("stage_seconds", timing.duration, stage="step")
+    usage = getattr(step, "token_usage", None)
+    if usage is not None:
+        inc("tokens_total", usage.input_tokens, kind="prompt")
+        inc("tokens_total", usage.output_tokens, kind="completion")
+    for call in getattr(step, "tool_calls", None) or []:
+        inc("tool_calls_total", tool=call.name)
+    if getattr(step, "error", None) is not None:
+        inc("step_errors_total")
+
+
+def instrument_tool(tool):
+    """
+    Time every call of the smolagents tool.
+    """
+    forward = tool.forward
+
+    def timed_forward(*args, **kwargs):
+        with timer("tool", tool=tool.name):
+            return forward(*args, **kwargs)
+
+    tool.forward = timed_forward
+    return tool
+
+
+def instrument_model(model):
+    """
+    Time every LLM call made through the smolagents model.
+    """
+    generate = model.generate
+    model.generate = timed("llm")(generate)
+
+    generate_stream = getattr(model, "generate_stream", None)
+    if generate_stream is not None:
+        def timed_stream(*args, **kwargs):
+            with timer("llm"):
+                yield from generate_stream(*args, **kwargs)
+
+        model.generate_stream = timed_stream
+    return model
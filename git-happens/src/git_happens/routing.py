@@ -0,0 +1,163 @@
+"""
+Per-request tool selection.
+
+The GitHub MCP server has dozens of tools, and the schemas of all of them are
+sent to the LLM in the system prompt and the tools of every step. Most
+requests need a handful. `ToolRouter` ranks the tools by how well their names
+and descriptions match the request, by keywords or, given an embedding
+function, by similarity, and `RoutedToolCallingAgent` only shows the LLM the
+best matches.
+"""
+import math
+import re
+from collections import Counter
+from typing import Callable, Iterable
+
+import smolagents
+
+# tools the agent always has, whatever the request
+ALWAYS = {"final_answer"}
+
+STOPWORDS = set(
+    "a an and are as at be by can could do does for from get give has have how i in "
+    "into is it its me my of on or our please show should tell that the their them "
+    "there this to us was we what when where which who why will with would you your".split()
+)
+
+# shorthand used in requests, and what the tool descriptions call it
+ALIASES = {
+    "pr": ["pull", "request"],
+    "prs": ["pull", "request"],
+    "repo": ["repository"],
+    "repos": ["repository"],
+    "mine": ["me"],
+    "ci": ["workflow", "run"],
+    "bug": ["issue"],
+    "ticket": ["issue"],
+    "readme": ["readme", "file", "content"],
+}
+
+
+def terms(text: str) -> list[str]:
+    """
+    Split text, and snake or camel case names, into lowercase search terms.
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text).replace("_", " ").lower()
+    out = []
+    for word in re.findall(r"[a-z0-9]+", text):
+        if word in STOPWORDS:
+            continue
+        for w in ALIASES.get(word, [word]):
+            # crude stemming, "issues" matches "issue"
+            out.append(w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w)
+    return out
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ToolRouter:
+    """
+    Ranks tools by how relevant they are to a request.
+
+    Without `embed` tools are scored by the request terms found in their name,
+    which count double, and description, weighted by how rare the terms are
+    among the tools. `embed` is a function returning an embedding per text,
+    with it tools are ranked by the similarity of their name and description
+    to the request instead.
+    """
+
+    def __init__(self, tools: Iterable, embed: Callable[[list[str]], list[list[float]]] | None = None):
+        self.tools = {t.name: t for t in tools}
+        self.embed = embed
+        self._names = {n: Counter(terms(n)) for n in self.tools}
+        self._docs = {n: Counter(terms(f"{n} {t.description}")) for n, t in self.tools.items()}
+        df = Counter(term for doc in self._docs.values() for term in doc)
+        n = len(self.tools)
+        # terms most tools share, like "github" and "repository", tell nothing apart
+        self._idf = {term: math.log(n / d) for term, d in df.items() if d <= n / 2}
+        self._embeddings = None
+
+    def scores(self, request: str) -> dict[str, float]:
+        if self.embed is not None:
+            if self._embeddings is None:
+                names = list(self.tools)
+                texts = [f"{n}: {self.tools[n].description}" for n in names]
+                self._embeddings = dict(zip(names, self.embed(texts)))
+            q = self.embed([request])[0]
+            return {n: _cosine(q, e) for n, e in self._embeddings.items()}
+
+        query = set(terms(request))
+        return {
+            n: sum(self._idf.get(t, 0.0) * (1 + (t in self._names[n])) for t in query if t in doc)
+            for n, doc in self._docs.items()
+        }
+
+    def select(self, request: str, k: int = 8) -> list[str]:
+        """
+        Return the names of the `k` tools most relevant to the request, or of
+        all tools if none of them match.
+        """
+        scores = self.scores(request)
+        ranked = sorted((n for n in scores if n not in ALWAYS and scores[n] > 0), key=lambda n: -scores[n])
+        if not ranked:
+            return list(self.tools)
+        return ranked[:k] + [n for n in self.tools if n in ALWAYS]
+
+
+def embeddings(client, model: str) -> Callable[[list[str]], list[list[float]]]:
+    """
+    Return an embedding function for `ToolRouter` using an OpenAI compatible
+    embeddings endpoint, such as a Databricks serving endpoint.
+    """
+    def embed(texts: list[str]) -> list[list[float]]:
+        return [d.embedding for d in client.embeddings.create(model=model, input=texts).data]
+
+    return embed
+
+
+class RoutedToolCallingAgent(smolagents.ToolCallingAgent):
+    """
+    Tool calling agent that only shows the LLM the `max_tools` tools most
+    relevant to the task, see `ToolRouter`.
+
+    When a conversation continues without resetting the memory, the tools
+    selected for earlier tasks stay available. All tools can still be called
+    if the LLM asks for one that was not selected.
+    """
+
+    def __init__(self, *args, router: ToolRouter | None = None, max_tools: int = 8, **kwargs):
+        # the parent renders the system prompt while initializing
+        self.selected = None
+        super().__init__(*args, **kwargs)
+        self.router = router or ToolRouter(self.tools.values())
+        self.max_tools = max_tools
+
+    def run(self, task: str, stream: bool = False, reset: bool = True, *args, **kwargs):
+        selected = self.router.select(task, self.max_tools)
+        if reset or self.selected is None:
+            self.selected = selected
+        else:
+            self.selected += [n for n in selected if n not in self.selected]
+        self.logger.log(f"Tools for this task: {', '.join(self.selected)}", level=smolagents.LogLevel.INFO)
+        return super().run(task, stream, reset, *args, **kwargs)
+
+    def routed_tools(self) -> dict:
+        if self.selected is None:
+            return self.tools
+        return {n: t for n, t in self.tools.items() if n in self.selected or n in ALWAYS}
+
+    @property
+    def tools_and_managed_agents(self):
+        return list(self.routed_tools().values()) + list(self.managed_agents.values())
+
+    def initialize_system_prompt(self) -> str:
+        # the system prompt template describes every tool in `self.tools`
+        tools, self.tools = self.tools, self.routed_tools()
+        try:
+            return super().initialize_system_prompt()
+        finally:
+            self.tools = tools
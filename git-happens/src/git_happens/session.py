@@ -0,0 +1,69 @@
+"""
+Long lived connection to the GitHub MCP server, shared by the whole process.
+
+The server is started, or connected to, on the first call to `get_tools` and
+the connection is kept open until the process exits, so every agent and every
+conversation reuses the same session instead of starting a new docker
+container.
+
+Set `GITHUB_MCP_URL` to connect to a GitHub MCP server that is already running
+over HTTP, for example GitHub's hosted server or a container shared between
+workers, instead of starting one in docker over stdio. `GITHUB_MCP_TRANSPORT`
+selects "streamable-http" (default) or "sse".
+"""
+import atexit
+import contextlib
+import os
+import threading
+
+# url of a running GitHub MCP server, if not set one is started in docker
+GITHUB_MCP_URL = os.environ.get("GITHUB_MCP_URL")
+GITHUB_MCP_TRANSPORT = os.environ.get("GITHUB_MCP_TRANSPORT", "streamable-http")
+
+_lock = threading.Lock()
+_stack = None
+_tools = None
+
+
+def server_parameters():
+    """
+    Return the parameters to connect to the GitHub MCP server with.
+    """
+    if GITHUB_MCP_URL:
+        params = {"url": GITHUB_MCP_URL, "transport": GITHUB_MCP_TRANSPORT}
+        if token := os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN"):
+            params["headers"] = {"Authorization": f"Bearer {token}"}
+        return params
+
+    from git_happens import get_params
+
+    return get_params()
+
+
+def get_tools() -> list:
+    """
+    Return the tools of the GitHub MCP server, connecting on the first call.
+    """
+    global _stack, _tools
+    with _lock:
+        if _tools is None:
+            import smolagents
+
+            stack = contextlib.ExitStack()
+            collection = stack.enter_context(
+                smolagents.ToolCollection.from_mcp(server_parameters(), trust_remote_code=True)
+            )
+            _stack, _tools = stack, list(collection.tools)
+            atexit.register(close)
+        return _tools
+
+
+def close():
+    """
+    Close the session, the next call to `get_tools` connects again.
+    """
+    global _stack, _tools
+    with _lock:
+        if _stack is not None:
+            _stack.close()
+        _stack = _tools = None
@@ -0,0 +1,199 @@
+"""
+Read-through cache of GitHub MCP tool results.
+
+Agents list the same issues, pull requests and files again and again, within
+and across conversations, and every call goes through the MCP server to the
+GitHub API and counts against its rate limit. The results of read-only tools,
+the ones named get_*, list_* and search_*, are cached by tool name and
+arguments until their time to live runs out. When any other tool runs, say
+`create_issue` or `push_files`, the cached results for the same repository are
+dropped, as are the results not tied to a repository, like searches. Calls
+whose arguments can not be told apart by name are never served from the
+cache, and such writes drop everything.
+
+`GIT_HAPPENS_TOOL_CACHE_TTL` sets the default time to live in seconds, 0
+turns the cache off.
+"""
+import collections
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any
+
+from . import metrics
+
+READ_PREFIXES = ("get_", "list_", "search_")
+
+# the MCP adapter returns tool errors as text, and the GitHub MCP server words
+# them like this, they are not cached so a rate limit or outage does not stick
+ERROR_PREFIXES = ("failed to", "error")
+
+DEFAULT_TTL = float(os.environ.get("GIT_HAPPENS_TOOL_CACHE_TTL", 60))
+
+# seconds to keep results of tools whose data changes slower or faster than most
+TTLS = {
+    "get_me": 3600,
+    "get_file_contents": 300,
+    "list_workflow_runs": 15,
+    "get_workflow_run": 15,
+    "list_notifications": 15,
+}
+
+
+def is_read(name: str) -> bool:
+    """
+    Return whether the tool only reads from GitHub.
+    """
+    return name.startswith(READ_PREFIXES)
+
+
+def scope(arguments: dict) -> tuple[str, str] | None:
+    """
+    Return the repository the tool call is about, if any.
+    """
+    owner, repo = arguments.get("owner"), arguments.get("repo")
+    if owner and repo:
+        return str(owner).lower(), str(repo).lower()
+    return None
+
+
+def call_arguments(signature: inspect.Signature, args: tuple, kwargs: dict) -> dict | None:
+    """
+    Return the arguments of a tool call by name, or None if some of them are
+    only known by position.
+    """
+    # smolagents passes a single dict of arguments positionally at times
+    if len(args) == 1 and not kwargs and isinstance(args[0], dict):
+        return args[0]
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        return None
+    arguments = {}
+    for name, value in bound.arguments.items():
+        kind = signature.parameters[name].kind
+        if kind is inspect.Parameter.VAR_POSITIONAL:
+            if value:
+                return None
+        elif kind is inspect.Parameter.VAR_KEYWORD:
+            arguments.update(value)
+        else:
+            arguments[name] = value
+    return arguments
+
+
+class ToolCache:
+    """
+    Thread-safe cache of tool results with a time to live per tool.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, ttls: dict[str, float] = TTLS, maxsize: int = 1024):
+        self.ttl = ttl
+        self.ttls = ttls
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        # (tool, arguments) -> (result, expires, scope)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_of(self, name: str) -> float:
+        return self.ttls.get(name, self.ttl) if self.ttl > 0 else 0
+
+    @staticmethod
+    def key(name: str, arguments: dict) -> tuple[str, str]:
+        return name, json.dumps(arguments, sort_keys=True, default=str)
+
+    def get(self, name: str, arguments: dict) -> tuple[bool, Any]:
+        """
+        Return (True, result) if the call is cached and fresh, else (False, None).
+        """
+        key = self.key(name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, name: str, arguments: dict, result: Any):
+        ttl = self.ttl_of(name)
+        if ttl <= 0:
+            return
+        key = self.key(name, arguments)
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + ttl, scope(arguments))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, repository: tuple[str, str] | None = None):
+        """
+        Drop the results for the repository and those not tied to one, or
+        everything if no repository is given.
+        """
+        with self._lock:
+            stale = [
+                k for k, (_, _, s) in self._entries.items()
+                if repository is None or s is None or s == repository
+            ]
+            for k in stale:
+                del self._entries[k]
+            self.invalidated += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidated": self.invalidated,
+            "size": len(self._entries),
+        }
+
+
+TOOL_CACHE = ToolCache()
+metrics.register_cache("tools", TOOL_CACHE.stats)
+
+
+def cached(tool, cache: ToolCache = TOOL_CACHE):
+    """
+    Serve the results of the smolagents tool from the cache if it is a read
+    tool, and invalidate the cache when it writes.
+    """
+    forward = tool.forward
+    name = tool.name
+    signature = inspect.signature(forward)
+
+    def cached_forward(*args, **kwargs):
+        arguments = call_arguments(signature, args, kwargs)
+        if not is_read(name):
+            try:
+                return forward(*args, **kwargs)
+            finally:
+                # even a failed write may have changed something, and without
+                # the arguments there is no telling which repository
+                cache.invalidate(scope(arguments) if arguments is not None else None)
+        if arguments is None:
+            return forward(*args, **kwargs)
+        hit, result = cache.get(name, arguments)
+        if hit:
+            return result
+        result = forward(*args, **kwargs)
+        if not (isinstance(result, str) and result.lower().startswith(ERROR_PREFIXES)):
+            cache.put(name, arguments, result)
+        return result
+
+    tool.forward = cached_forward
+    return tool
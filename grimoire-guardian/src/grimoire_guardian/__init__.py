@@ -1,72 +1,263 @@
+"""
+Answer questions about a document with a LangGraph agent searching a FAISS index.
+
+Importing the package is cheap. Torch, langchain, langgraph and unstructured
+are imported when first needed, and the embedding model and the Databricks
+clients are created on first use, see `get_embedder` and `get_client`. The
+module attributes `embedder`, `wc` and `client` are kept and resolve to those.
+"""
+import functools
+import os
 import pathlib
-from typing import Annotated
-from typing_extensions import TypedDict
-import databricks.sdk
-import langchain.chat_models
-from langgraph.graph import StateGraph, START
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
-from langchain.prompts import ChatPromptTemplate
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-import langchain_unstructured
-import torch
-import streamlit as st
+from typing import TYPE_CHECKING
+
+from . import metrics, semcache
+from .cache import QueryCache
+from .semcache import SemanticCache
+from .store import IndexStore, file_digest, index_key
+
+if TYPE_CHECKING:
+    from langgraph.graph import StateGraph
 
 
 MODEL = "data-science-gpt-4o"
 MODEL_EMB = "sentence-transformers/all-MiniLM-L6-v2"
 DOC = "harry-potter-and-the-sorcerers-stone.pdf"
 
-embedder = HuggingFaceEmbeddings(
-    model_name=MODEL_EMB,
-    model_kwargs={
-        "model_kwargs": {"torch_dtype": torch.float16}
-    },  # half precision for faster inference
-    encode_kwargs={"normalize_embeddings": False, "batch_size": 16},
-    show_progress=True,
-)
+# how documents are chunked before indexing. these are part of the index cache
+# key, so changing them triggers a rebuild of cached indexes.
+CHUNKING = {
+    "loader": "unstructured",
+    "chunk_size": 4000,
+    "chunk_overlap": 200,
+    "categories": ["NarrativeText"],
+}
+
+# how the embedding model is run, see `grimoire_guardian.embeddings`. the
+# backend is part of the index cache key, quantized models give slightly
+# different vectors.
+EMBEDDINGS = {
+    "backend": os.environ.get("GRIMOIRE_EMBEDDINGS", "torch"),
+    "batch_size": 16,
+}
+
+# type of index to build and its parameters, see `grimoire_guardian.ann`.
+# also part of the index cache key.
+INDEX = {"type": "flat"}
+
+# maximum number of tokens of retrieved text the search tool hands to the LLM
+CONTEXT_TOKENS = 6000
+
+# on-disk cache of built indexes
+STORE = IndexStore()
+
+# in-memory cache of query embeddings and search results
+QUERY_CACHE = QueryCache()
+
+# on-disk semantic cache of answers
+ANSWER_CACHE = SemanticCache()
+
+metrics.register_cache("embedding", QUERY_CACHE.embeddings.stats)
+metrics.register_cache("results", QUERY_CACHE.results.stats)
+metrics.register_cache("answer", ANSWER_CACHE.stats)
+
+
+@functools.cache
+def get_embedder():
+    """
+    Return the embedding model, loading it on the first call.
+    """
+    from .embeddings import Embedder
+
+    return Embedder(MODEL_EMB, **EMBEDDINGS)
+
+
+@functools.cache
+def get_workspace_client():
+    import databricks.sdk
 
-# get databricks workspace client and fetch the OpenAI client towards
-# serving endpoints.
-wc = databricks.sdk.WorkspaceClient()
-client = wc.serving_endpoints.get_open_ai_client()
+    return databricks.sdk.WorkspaceClient()
 
 
-def create_index(doc: str):
+@functools.cache
+def get_client():
+    """
+    Return the OpenAI client towards the Databricks serving endpoints.
+    """
+    return get_workspace_client().serving_endpoints.get_open_ai_client()
+
+
+# module attributes created on first access
+_LAZY = {"embedder": get_embedder, "wc": get_workspace_client, "client": get_client}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def embed_query(q: str) -> list[float]:
+    with metrics.timer("embedding"):
+        return get_embedder().embed_query(q)
+
+
+def load_chunks(doc: str) -> list:
+    """
+    Parse the document and return the chunks that should be indexed.
+    """
+    import langchain_unstructured
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     # load document and chunk it
     # this function should support quite a lot of different file formats
     ld = langchain_unstructured.UnstructuredLoader(doc)
-    chunks = ld.load_and_split()
+    chunks = ld.load_and_split(
+        RecursiveCharacterTextSplitter(
+            chunk_size=CHUNKING["chunk_size"],
+            chunk_overlap=CHUNKING["chunk_overlap"],
+        )
+    )
 
-    # filter out only narrative text to index and create index
-    chunks = list(filter(lambda x: x.metadata["category"] == "NarrativeText", chunks))
-    idx = FAISS.from_documents(chunks, embedder)
+    # filter out only narrative text to index, and remember the position of
+    # each chunk so neighbouring chunks can be stitched back together later
+    chunks = [x for x in chunks if x.metadata["category"] in CHUNKING["categories"]]
+    for i, x in enumerate(chunks):
+        x.metadata["chunk_index"] = i
+    return chunks
+
+
+def create_index(doc: str, store: IndexStore | None = STORE, index: dict = INDEX):
+    """
+    Create a FAISS index over the document.
+
+    `index` selects the type of index and its parameters, e.g.
+    `{"type": "ivf-pq", "nlist": 1024}`, see `grimoire_guardian.ann`.
+
+    Built indexes are saved in `store` keyed by the document contents, the
+    chunking settings, the embedding model and the index settings. Later calls
+    for the same document memory map the stored index and never run the parser
+    or the embedding model. Pass `store=None` to always rebuild.
+
+    Raises ValueError if the document has no text to index.
+    """
+    if store is not None:
+        key = index_key(
+            file_digest(doc), chunking=CHUNKING, model=MODEL_EMB, backend=EMBEDDINGS["backend"], index=index
+        )
+        idx = store.get(key, get_embedder())
+        if idx is not None:
+            return idx
+
+    # imported here as the pipeline itself depends on this module
+    from .ingest import ingest
+
+    idx = ingest([doc], index=index)
+    if idx is None:
+        # e.g. an empty or scanned PDF, there is nothing to search or cache
+        raise ValueError(f"no text to index in {doc}")
+
+    if store is not None:
+        store.put(key, idx, doc=str(doc), model=MODEL_EMB)
 
     return idx
 
 
-def search_index(idx, q: str, topk: int = 50):
+def search_index(
+    idx,
+    q: str,
+    topk: int = 50,
+    nprobe: int | None = None,
+    ef_search: int | None = None,
+    mmr: float | None = None,
+    cache: QueryCache | None = QUERY_CACHE,
+):
     """
     Search the index for the query and return the topk results.
+
+    `nprobe` sets the number of lists searched in IVF indexes and `ef_search`
+    the size of the candidate list in HNSW indexes, overriding the defaults
+    the index was created with. Both are ignored for index types they do not
+    apply to.
+
+    With `mmr` results are diversified with maximal marginal relevance, where
+    1 is pure relevance and 0 is maximum diversity. This needs to read back
+    vectors from the index, which only flat and HNSW indexes support.
+
+    Query embeddings and results are cached in `cache`, pass None to disable.
     """
-    retriever = idx.as_retriever(search_kwargs={"k": topk})
-    docs = retriever.invoke(q)
+    from . import ann
+
+    if cache is None:
+        e = embed_query(q)
+    else:
+        key = cache.key(idx, q, topk, nprobe, ef_search, mmr)
+        docs = cache.results.get(key)
+        if docs is not None:
+            return docs
+        e = cache.embed(MODEL_EMB, q, embed_query)
+
+    params = ann.search_params(idx.index, nprobe=nprobe, ef_search=ef_search)
+    with metrics.timer("retrieval"):
+        if mmr is not None:
+            docs = idx.max_marginal_relevance_search_by_vector(
+                e, k=topk, fetch_k=4 * topk, lambda_mult=mmr
+            )
+        elif params is not None:
+            docs = ann.search(idx, e, topk, params)
+        else:
+            docs = idx.similarity_search_by_vector(e, k=topk)
+
+    if cache is not None:
+        cache.results.put(key, docs)
     return docs
 
 
-def graph(idx) -> StateGraph:
+@functools.cache
+def read_sysprompt() -> str:
+    with open(pathlib.Path(__file__).parent / "sysprompt.txt") as f:
+        return f.read()
+
+
+def graph(
+    idx,
+    context_tokens: int = CONTEXT_TOKENS,
+    mmr: float | None = None,
+    cache: SemanticCache | None = ANSWER_CACHE,
+    nprobe: int | None = None,
+    ef_search: int | None = None,
+) -> "StateGraph":
     """
     return graph
+
+    The search tool packs the retrieved chunks into at most `context_tokens`
+    tokens, see `grimoire_guardian.context.pack`. Set `mmr` to diversify
+    search results, and `nprobe` or `ef_search` to override what the index
+    is searched with by default, see `search_index`.
+
+    Answers are cached in `cache` for the version of the index and the
+    settings above, the chat model and the system prompt, and questions
+    similar to one already answered, with the same names and numbers, get the
+    cached answer without searching or calling the LLM. Pass None to disable.
     """
+    from typing import Annotated
+    from typing_extensions import TypedDict
+
+    import langchain.chat_models
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_core.messages import AIMessage
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode, tools_condition
+
+    from . import context
 
     #
     # Setup LLM
     #
 
     # read system prompt for the agent
-    with open(pathlib.Path(__file__).parent / "sysprompt.txt") as f:
-        prompt = f.read()
+    prompt = read_sysprompt()
 
     def search(q: str) -> str:
         """
@@ -76,17 +267,21 @@ def graph(idx) -> StateGraph:
             q (str): Query.
 
         Returns:
-            str: All relevant chunks delimited by "\n\n=======\n\n".
+            str: The most relevant chunks delimited by "\n\n=======\n\n".
         """
-        docs = search_index(idx, q)
-        return "\n\n=======\n\n".join([x.page_content for x in docs])
+        with metrics.timer("tool", tool="search"):
+            docs = search_index(idx, q, nprobe=nprobe, ef_search=ef_search, mmr=mmr)
+            docs = context.pack(docs, context_tokens)
+            return "\n\n=======\n\n".join([x.page_content for x in docs])
 
     # the agent will have as a tool to be able to search the document
     tool = search
     llm = langchain.chat_models.init_chat_model(
         f"openai:{MODEL}",
-        base_url=str(client.base_url),
+        base_url=str(get_client().base_url),
         temperature=0.1,
+        # token counts for the metrics when streaming
+        stream_usage=True,
     ).bind_tools([tool])
 
     #
@@ -97,12 +292,19 @@ def graph(idx) -> StateGraph:
     class State(TypedDict):
         query: str
         messages: Annotated[list, add_messages]
+        cached: bool
 
     # Node handling interaction with the LLM
     def chatbot(state: State):
+        with metrics.timer("llm"):
+            msg = llm.invoke(state["messages"])
+        usage = getattr(msg, "usage_metadata", None)
+        if usage:
+            metrics.inc("tokens_total", usage.get("input_tokens", 0), kind="prompt")
+            metrics.inc("tokens_total", usage.get("output_tokens", 0), kind="completion")
         return {
             "query": state["query"],
-            "messages": [llm.invoke(state["messages"])],
+            "messages": [msg],
         }
 
     # Node for invoking tools
@@ -123,6 +325,29 @@ def graph(idx) -> StateGraph:
             "messages": prompt_template.invoke({"input": state["query"]}).messages,
         }
 
+    # Nodes looking up and storing answers in the semantic cache
+    settings = semcache.settings_version(
+        model=MODEL, prompt=prompt, context_tokens=context_tokens, mmr=mmr, nprobe=nprobe, ef_search=ef_search
+    )
+
+    def scope_and_embedding(query: str):
+        scope = semcache.index_version(idx, QUERY_CACHE.version(idx))
+        return f"{scope}-{settings}", QUERY_CACHE.embed(MODEL_EMB, query, embed_query)
+
+    def lookup(state: State):
+        scope, e = scope_and_embedding(state["query"])
+        answer = cache.get(scope, state["query"], e)
+        if answer is None:
+            return {"cached": False}
+        return {"cached": True, "messages": [AIMessage(content=answer)]}
+
+    def remember(state: State):
+        answer = state["messages"][-1].content
+        if isinstance(answer, str) and answer:
+            scope, e = scope_and_embedding(state["query"])
+            cache.put(scope, state["query"], e, answer)
+        return {}
+
     # create graph
     graph_builder = StateGraph(State)
 
@@ -132,9 +357,23 @@ def graph(idx) -> StateGraph:
     graph_builder.add_node("sysprompt", sysprompt)
 
     # edges
-    graph_builder.add_edge(START, "sysprompt")
+    if cache is None:
+        graph_builder.add_edge(START, "sysprompt")
+        graph_builder.add_conditional_edges("chatbot", tools_condition)
+    else:
+        graph_builder.add_node("cache", lookup)
+        graph_builder.add_node("remember", remember)
+        graph_builder.add_edge(START, "cache")
+        graph_builder.add_conditional_edges(
+            "cache", lambda state: END if state["cached"] else "sysprompt"
+        )
+        # answers without tool calls are final and get cached
+        graph_builder.add_conditional_edges(
+            "chatbot",
+            lambda state: "tools" if tools_condition(state) == "tools" else "remember",
+        )
+        graph_builder.add_edge("remember", END)
     graph_builder.add_edge("sysprompt", "chatbot")
-    graph_builder.add_conditional_edges("chatbot", tools_condition)
     # Any time a tool is called, we return to the chatbot to decide the next step
     graph_builder.add_edge("tools", "chatbot")
 
@@ -143,7 +382,35 @@ def graph(idx) -> StateGraph:
     return graph
 
 
+def stream(g, query: str):
+    """
+    Run the graph on the query and yield what happens as it happens.
+
+    Yields (kind, value) tuples where kind is one of
+    - "token": a piece of text generated by the LLM
+    - "tool_call": a tool call requested by the LLM, as a dict
+    - "tool_result": the output of a tool call, as a string
+    """
+    for mode, chunk in g.stream({"query": query}, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            msg, meta = chunk
+            # only the chatbot node generates text, other nodes' messages
+            # arrive complete through the updates
+            if meta.get("langgraph_node") == "chatbot" and isinstance(msg.content, str) and msg.content:
+                yield "token", msg.content
+        elif "chatbot" in chunk:
+            for tc in getattr(chunk["chatbot"]["messages"][-1], "tool_calls", []):
+                yield "tool_call", tc
+        elif "tools" in chunk:
+            for m in chunk["tools"]["messages"]:
+                yield "tool_result", m.content
+        elif chunk.get("cache") and chunk["cache"].get("cached"):
+            # answered from the semantic cache, the whole answer at once
+            yield "token", chunk["cache"]["messages"][-1].content
+
+
 def main() -> None:
+    metrics.setup()
     idx = create_index(DOC)
     g = graph(idx)
     print(g.invoke({"query": "what happened to harry's parents?"}))
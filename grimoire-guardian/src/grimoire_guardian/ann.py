@@ -0,0 +1,157 @@
+"""
+Approximate nearest neighbour index types.
+
+A flat index compares the query against every vector, so search time and
+memory grow linearly with the corpus. For large corpora one of the approximate
+types trades a little recall for a lot of speed and memory:
+
+- "flat": exact search, the default
+- "ivf-flat": vectors are clustered into `nlist` lists and only the `nprobe`
+  closest lists are searched
+- "ivf-pq": like ivf-flat but vectors are compressed with product quantization
+  into `m` bytes each
+- "hnsw": graph based search, `ef_search` trades speed for recall
+
+Use `evaluate` to measure the recall of an index against a flat baseline
+while tuning the knobs.
+"""
+import math
+import time
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+
+TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+# faiss wants about 39 training points per inverted list
+POINTS_PER_LIST = 39
+
+# size of the HNSW candidate list when searching, faiss defaults to 16
+EF_SEARCH = 64
+
+
+def default_nprobe(nlist: int) -> int:
+    """
+    Return the number of inverted lists to search by default, faiss searches
+    only one which loses most of the recall.
+    """
+    return max(min(nlist, 8), nlist // 16)
+
+
+def create(
+    type: str,
+    dim: int,
+    n: int,
+    nlist: int | None = None,
+    m: int | None = None,
+    nbits: int = 8,
+    hnsw_m: int = 32,
+    nprobe: int | None = None,
+    ef_search: int = EF_SEARCH,
+) -> faiss.Index:
+    """
+    Create an empty index of the given type for `dim` dimensional vectors.
+
+    `nprobe` and `ef_search` are stored with the index as the defaults to
+    search it with, `search_params` overrides them per search. `nprobe`
+    defaults to `default_nprobe(nlist)`.
+
+    `n` is the number of vectors available for training and is used to pick a
+    sensible number of inverted lists if `nlist` is not given. With too few
+    vectors to train on, ivf-pq falls back to ivf-flat, which needs
+    2**nbits vectors to train the product quantizer, and ivf-flat falls back
+    to flat, which needs POINTS_PER_LIST.
+    """
+    if type not in TYPES:
+        raise ValueError(f"unknown index type {type!r}, expected one of {TYPES}")
+    if type == "ivf-pq" and n < 2**nbits:
+        type = "ivf-flat"
+    if type == "ivf-flat" and n < POINTS_PER_LIST:
+        type = "flat"
+
+    if type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if type == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{hnsw_m}")
+        index.hnsw.efSearch = ef_search
+        return index
+
+    nlist = nlist or int(4 * math.sqrt(n))
+    nlist = max(1, min(nlist, n // POINTS_PER_LIST))
+    if type == "ivf-flat":
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+    else:
+        # the number of sub-quantizers has to divide the dimension
+        m = m or next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{m}x{nbits}")
+    faiss.extract_index_ivf(index).nprobe = min(nprobe or default_nprobe(nlist), nlist)
+    return index
+
+
+def train(index: faiss.Index, vectors: np.ndarray, max_points: int = 100_000, seed: int = 0):
+    """
+    Train the index on a random sample of at most `max_points` vectors.
+    """
+    if index.is_trained:
+        return
+    if len(vectors) > max_points:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), max_points, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def search_params(index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None):
+    """
+    Return faiss search parameters for the index, or None if there are none to set.
+
+    The parameters are passed along with each search instead of being set on
+    the index, so concurrent searches with different settings do not race.
+    """
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def search(idx: FAISS, embedding: list[float], k: int, params=None) -> list:
+    """
+    Return the documents of the `k` nearest neighbours of the embedding.
+    """
+    x = np.array([embedding], dtype=np.float32)
+    _, ids = idx.index.search(x, k, params=params)
+    return [
+        idx.docstore.search(idx.index_to_docstore_id[i]) for i in ids[0] if i != -1
+    ]
+
+
+def evaluate(idx: FAISS, baseline: FAISS, queries: list[str], k: int = 10, nprobe: int | None = None, ef_search: int | None = None) -> dict:
+    """
+    Measure recall@k and search latency of `idx` against an exact `baseline`.
+
+    Both indexes should be built over the same chunks. Results are matched on
+    chunk contents, so the two do not have to share document ids.
+    """
+    embeddings = idx.embedding_function.embed_documents(queries)
+    params = search_params(idx.index, nprobe=nprobe, ef_search=ef_search)
+
+    hits = total = 0
+    latencies = []
+    for e in embeddings:
+        truth = {d.page_content for d in search(baseline, e, k)}
+        t = time.perf_counter()
+        found = search(idx, e, k, params)
+        latencies.append(time.perf_counter() - t)
+        hits += len(truth & {d.page_content for d in found})
+        total += len(truth)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall": hits / max(total, 1),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "ntotal": idx.index.ntotal,
+        "bytes": faiss.serialize_index(idx.index).nbytes,
+    }
@@ -1,6 +1,8 @@
 import streamlit as st
-from grimoire_guardian import graph, create_index, DOC
-import langchain_core
+from grimoire_guardian import DOC, metrics, stream
+from grimoire_guardian.registry import registry
+
+metrics.setup()
 
 st.title("Grimoire Guardian")
 st.markdown(f"Ask it anything about '{DOC}'")
@@ -9,13 +11,10 @@ st.markdown(f"Ask it anything about '{DOC}'")
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-
-if "idx" not in st.session_state:
-    with st.spinner("Indexing document..."):
-        st.session_state.idx = create_index(DOC)
-        st.success("Setup complete!")
-
-g = graph(st.session_state.idx)
+# the index and compiled graph are shared by all sessions, only the first
+# session to ask for them pays for building
+with st.spinner("Indexing document..."):
+    g = registry.graph(DOC)
 
 # Display chat messages from history on app rerun
 for message in st.session_state.messages:
@@ -31,16 +30,22 @@ if prompt := st.chat_input("What is up?"):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    res = g.invoke({"query": prompt})
-    for m in langchain_core.messages.utils.convert_to_openai_messages(res["messages"]):
-        if m["role"] in ["system", "user"]:
+    # render tool calls, tool results and generated text as they happen
+    # instead of waiting for the whole run to finish
+    text, placeholder = "", None
+    for kind, value in stream(g, prompt):
+        if kind == "token":
+            if placeholder is None:
+                placeholder = st.chat_message("assistant").empty()
+            text += value
+            placeholder.markdown(text)
             continue
 
-        with st.chat_message(m["role"]):
-            if "tool_calls" in m:
-                st.markdown(f"```\n{m['tool_calls']}\n```")
-            if m["role"] == "tool":
+        text, placeholder = "", None
+        if kind == "tool_call":
+            with st.chat_message("assistant"):
+                st.markdown(f"```\n{value}\n```")
+        elif kind == "tool_result":
+            with st.chat_message("tool"):
                 with st.expander("Tool results"):
-                    st.markdown(m["content"])
-            else:
-                st.markdown(m["content"])
+                    st.markdown(value)
@@ -0,0 +1,133 @@
+"""
+In-memory caches for query embeddings and search results.
+
+The agent tends to search for the same or nearly the same thing several times
+in a row, and users ask the same popular questions. Caching the query
+embedding saves running the embedding model, caching the results also saves
+the index search.
+"""
+import collections
+import itertools
+import re
+import threading
+import time
+import weakref
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache with an optional time to live.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, pred):
+        """
+        Remove all entries whose key matches the predicate.
+        """
+        with self._lock:
+            for key in [k for k in self._data if pred(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+def normalize(q: str) -> str:
+    """
+    Normalize a query so trivially different spellings share cache entries.
+    """
+    return " ".join(q.lower().split()).strip(" .?!")
+
+
+class QueryCache:
+    """
+    Cache of query embeddings and search results.
+
+    Results are keyed by the normalized query, the version of the index and
+    the search parameters. Every index object gets a version on first use,
+    call `invalidate` after modifying an index to give it a new one and drop
+    its cached results.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float | None = 3600):
+        self.embeddings = LRUCache(maxsize)
+        self.results = LRUCache(maxsize, ttl)
+        self._versions = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def version(self, idx) -> int:
+        with self._lock:
+            if idx not in self._versions:
+                self._versions[idx] = next(self._counter)
+            return self._versions[idx]
+
+    def invalidate(self, idx):
+        """
+        Give the index a new version and drop the results cached for the old one.
+        """
+        with self._lock:
+            old = self._versions.get(idx)
+            self._versions[idx] = next(self._counter)
+        if old is not None:
+            self.results.discard(lambda k: k[0] == old)
+
+    def embed(self, model: str, q: str, embed_fn) -> list[float]:
+        """
+        Return the embedding of the query, computing it with `embed_fn` on a miss.
+
+        Entries are keyed by the normalized query, but the query is embedded as
+        given, so the cache does not change the vectors searched with.
+        """
+        key = (model, normalize(q))
+        e = self.embeddings.get(key)
+        if e is None:
+            e = embed_fn(q)
+            self.embeddings.put(key, e)
+        return e
+
+    def key(self, idx, q: str, *params) -> tuple:
+        return (self.version(idx), normalize(q), *params)
+
+    def stats(self) -> dict:
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
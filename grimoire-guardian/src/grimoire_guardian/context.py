@@ -0,0 +1,165 @@
+"""
+Post-processing of retrieved chunks before they are handed to the LLM.
+
+Retrieval returns many chunks that overlap (the splitter repeats the end of a
+chunk at the start of the next), are near duplicates of each other or are
+direct neighbours in the document. `pack` removes duplicates, stitches
+neighbours back together and keeps the most relevant text that fits in a token
+budget, so prompts stay small without losing information.
+"""
+import functools
+import re
+
+from langchain_core.documents import Document
+
+
+@functools.cache
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # the encoding is downloaded on first use, which fails on hosts
+        # without internet access. fall back to estimating.
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        # roughly four characters per token for english text
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def shingles(text: str, n: int = 5) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def dedupe(docs: list[Document], threshold: float = 0.8) -> list[Document]:
+    """
+    Drop chunks that are contained in, or nearly identical to, a more relevant chunk.
+
+    `docs` are expected in order of relevance, and similarity is measured as
+    the jaccard similarity of word 5-grams.
+    """
+    kept = []
+    for d in docs:
+        text = " ".join(d.page_content.split())
+        sh = shingles(text)
+        dup = False
+        for k, ktext, ksh in kept:
+            if text in ktext or len(sh & ksh) / len(sh | ksh) >= threshold:
+                dup = True
+                break
+        if not dup:
+            kept.append((d, text, sh))
+    return [d for d, _, _ in kept]
+
+
+def _position(d: Document):
+    m = d.metadata
+    if "chunk_index" not in m:
+        return None
+    return m.get("source"), m["chunk_index"]
+
+
+def _join(a: str, b: str, max_overlap: int = 1000) -> str:
+    # the splitter repeats up to `chunk_overlap` characters of a chunk at the
+    # start of the next one, find the longest such overlap and drop it
+    for n in range(min(len(a), len(b), max_overlap), 0, -1):
+        if a.endswith(b[:n]):
+            return a + b[n:]
+    return a + "\n" + b
+
+
+def _runs(docs: list[Document]) -> list[list[int]]:
+    """
+    Group the indices of chunks that follow each other in the same document
+    and page, in document order. Groups are ordered by their most relevant
+    chunk.
+    """
+    pos = {}
+    for i, d in enumerate(docs):
+        p = _position(d)
+        if p is not None:
+            pos[p] = i
+
+    def page(i):
+        return docs[i].metadata.get("page_number")
+
+    # walk every run of consecutive chunks from its first chunk, which is one
+    # whose predecessor was not retrieved or is on another page
+    runs = {}
+    in_run = set()
+    for i, d in enumerate(docs):
+        p = _position(d)
+        if p is None:
+            runs[i] = [i]
+            continue
+        prev = pos.get((p[0], p[1] - 1))
+        if prev is not None and page(prev) == page(i):
+            continue
+        run = [i]
+        while (p[0], p[1] + len(run)) in pos:
+            nxt = pos[(p[0], p[1] + len(run))]
+            if page(nxt) != page(i):
+                break
+            run.append(nxt)
+        runs[min(run)] = run
+        in_run.update(run)
+    # chunks that were neither the start of a run nor part of one, such as a
+    # chunk repeated under the same position, are kept as they are
+    for i in range(len(docs)):
+        if i not in runs and i not in in_run:
+            runs[i] = [i]
+    return [runs[i] for i in sorted(runs)]
+
+
+def _merge(parts: list[Document]) -> Document:
+    if len(parts) == 1:
+        return parts[0]
+    text = parts[0].page_content
+    for d in parts[1:]:
+        text = _join(text, d.page_content)
+    return Document(page_content=text, metadata=parts[0].metadata)
+
+
+def merge_adjacent(docs: list[Document]) -> list[Document]:
+    """
+    Merge chunks that follow each other in the same document and page.
+
+    The merged chunk takes the place of its most relevant part.
+    """
+    return [_merge([docs[j] for j in run]) for run in _runs(docs)]
+
+
+def pack(docs: list[Document], budget: int, threshold: float = 0.8) -> list[Document]:
+    """
+    Return the most relevant chunks that fit in `budget` tokens.
+
+    `docs` are expected in order of relevance. Duplicates are removed and
+    neighbouring chunks merged before packing. If a merged chunk does not fit,
+    the parts of it that do are used instead.
+    """
+    docs = dedupe(docs, threshold)
+    out = []
+    used = 0
+
+    def fit(d: Document) -> bool:
+        nonlocal used
+        n = count_tokens(d.page_content)
+        # a less relevant but shorter chunk might still fit
+        if used + n > budget:
+            return False
+        out.append(d)
+        used += n
+        return True
+
+    for run in _runs(docs):
+        if not fit(_merge([docs[j] for j in run])) and len(run) > 1:
+            for j in sorted(run):
+                fit(docs[j])
+    return out
@@ -0,0 +1,201 @@
+"""
+Incrementally maintained index over a directory of documents.
+
+The corpus keeps track of the hash and chunk ids of every indexed file. On
+refresh only new or changed files are parsed and embedded, and the vectors of
+changed or removed files are deleted, so keeping a large library up to date
+costs time proportional to what changed rather than to the size of the library.
+
+Files that fail to parse, like binaries matched by the pattern, are skipped and
+keep whatever they had in the index before. Old vectors are only deleted once
+the new ones have been added.
+
+IVF indexes are clustered on the vectors of the first refresh. Once the corpus
+has grown RETRAIN_FACTOR times beyond that, the index is rebuilt from the
+stored chunks so the clusters, and the index type picked for its size, fit the
+corpus again.
+"""
+import pathlib
+import sys
+import threading
+
+from langchain_community.vectorstores import FAISS
+
+from grimoire_guardian import CHUNKING, EMBEDDINGS, INDEX, MODEL_EMB, QUERY_CACHE, STORE, get_embedder, metrics
+from grimoire_guardian.ingest import Pipeline
+from grimoire_guardian.store import IndexStore, file_digest, index_key, load_index, read_meta, save_index
+
+# rebuild trained indexes when the corpus is this many times larger than the
+# set of vectors the index was trained on
+RETRAIN_FACTOR = 4
+
+
+class Corpus:
+    """
+    FAISS index over all files below `root` matching `pattern`.
+
+    The index and the per-file manifest are persisted in `store`, so a new
+    process picks up where the last one left off. `refresh` is serialized by
+    a lock, but searching while a refresh is running is not safe.
+
+    `index` selects the index type, see `grimoire_guardian.ann`. Note that
+    faiss can not remove vectors from HNSW indexes, so those only support
+    adding files.
+    """
+
+    def __init__(self, root, store: IndexStore = STORE, pattern: str = "**/*", index: dict = INDEX):
+        self.root = pathlib.Path(root).resolve()
+        self.pattern = pattern
+        self.index_settings = index
+        self.path = store.path(
+            index_key(
+                str(self.root),
+                kind="corpus",
+                chunking=CHUNKING,
+                model=MODEL_EMB,
+                backend=EMBEDDINGS["backend"],
+                index=index,
+            )
+        )
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Load the index and manifest as last saved, or start empty.
+        """
+        self.idx = None
+        self.files = {}
+        self.trained = None
+        meta = read_meta(self.path)
+        if meta is not None:
+            # the index is modified in place so it can not be memory mapped
+            self.idx = load_index(self.path, get_embedder(), mmap=False)
+            self.files = meta["files"]
+            self.trained = meta.get("trained", self.idx.index.ntotal)
+
+    def scan(self):
+        """
+        Yield the relative path and stat of every file in the corpus.
+        """
+        for path in sorted(self.root.glob(self.pattern)):
+            rel = path.relative_to(self.root)
+            if any(p.startswith(".") for p in rel.parts) or not path.is_file():
+                continue
+            yield rel.as_posix(), path.stat()
+
+    def refresh(self) -> dict:
+        """
+        Bring the index up to date with the files on disk.
+
+        Returns the relative paths that were added, updated, removed and
+        failed to parse.
+        """
+        with self._lock:
+            try:
+                return self._refresh()
+            except BaseException:
+                # the index is changed in place, drop whatever was half done
+                self.load()
+                raise
+
+    def _refresh(self) -> dict:
+        files = {}
+        changed = {}
+        for rel, st in self.scan():
+            old = self.files.get(rel)
+            # size and mtime unchanged, trust that the contents are too
+            if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                files[rel] = old
+                continue
+
+            digest = file_digest(self.root / rel)
+            if old and old["digest"] == digest:
+                files[rel] = {**old, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            else:
+                changed[rel] = {"digest": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+        removed = [rel for rel in self.files if rel not in files and rel not in changed]
+        updated = [rel for rel in changed if rel in self.files]
+        added = [rel for rel in changed if rel not in self.files]
+
+        def chunk_ids(doc, chunks):
+            rel = pathlib.Path(doc).relative_to(self.root).as_posix()
+            return [f"{rel}#{changed[rel]['digest'][:12]}#{i}" for i in range(len(chunks))]
+
+        # chunk ids include the digest, so new vectors of an updated file do
+        # not clash with the old ones still in the index
+        errors = {}
+        pipeline = Pipeline(self.idx, index=self.index_settings)
+        docs = [str(self.root / rel) for rel in changed]
+        for doc, ids in pipeline.run(docs, ids=chunk_ids, errors=errors):
+            rel = pathlib.Path(doc).relative_to(self.root).as_posix()
+            files[rel] = {**changed[rel], "ids": ids}
+
+        failed = [pathlib.Path(doc).relative_to(self.root).as_posix() for doc in errors]
+        for rel in failed:
+            # keep serving the last version that could be parsed
+            if rel in self.files:
+                files[rel] = self.files[rel]
+        updated = [rel for rel in updated if rel not in failed]
+        added = [rel for rel in added if rel not in failed]
+
+        # drop vectors of everything that is gone or has been re-indexed
+        stale = [id for rel in removed + updated for id in self.files[rel]["ids"]]
+        if stale:
+            pipeline.idx.delete(stale)
+        self.idx = pipeline.idx
+        if pipeline.trained is not None:
+            self.trained = pipeline.trained
+        if self.needs_retrain():
+            self.retrain()
+
+        self.files = files
+        if (added or updated or removed) and self.idx is not None:
+            QUERY_CACHE.invalidate(self.idx)
+            meta = {"root": str(self.root), "files": self.files, "trained": self.trained}
+            save_index(self.path, self.idx, meta)
+
+        return {"added": added, "updated": updated, "removed": removed, "failed": failed}
+
+    def needs_retrain(self) -> bool:
+        """
+        Return whether the index has outgrown the vectors it was trained on.
+        """
+        if self.idx is None or self.index_settings["type"] not in ("ivf-flat", "ivf-pq"):
+            return False
+        return self.idx.index.ntotal >= RETRAIN_FACTOR * max(self.trained or 0, 1)
+
+    def retrain(self):
+        """
+        Rebuild the index from the stored chunks, training it on all of them.
+
+        Chunks are embedded again rather than read back from the index, as
+        product quantized vectors can not be recovered exactly.
+        """
+        with metrics.timer("retrain"):
+            ids = list(self.idx.index_to_docstore_id.values())
+            pipeline = Pipeline(None, index=self.index_settings)
+            pipeline.add_chunks([(self.idx.docstore.search(id), id) for id in ids])
+        self.idx = pipeline.idx
+        self.trained = pipeline.trained
+
+    @property
+    def index(self) -> FAISS | None:
+        """
+        The index over the corpus, None until a refresh has indexed any chunks.
+        """
+        return self.idx
+
+
+def main() -> None:
+    metrics.setup()
+    corpus = Corpus(sys.argv[1])
+    res = corpus.refresh()
+    for k, v in res.items():
+        print(f"{k}: {len(v)}")
+    print(f"files: {len(corpus.files)}")
+
+
+if __name__ == "__main__":
+    main()
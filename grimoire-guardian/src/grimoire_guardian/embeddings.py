@@ -0,0 +1,142 @@
+"""
+Embedding backends for CPU inference.
+
+The sentence transformer can be run by one of these backends:
+
+- "torch": the PyTorch model in full precision. Half precision is slower than
+  full precision on most CPUs, so it is only used on GPUs.
+- "torch-int8": the PyTorch model with its linear layers dynamically
+  quantized to int8.
+- "onnx": the model exported to ONNX and run by ONNX Runtime.
+- "onnx-int8": the ONNX model dynamically quantized to int8. The quantized
+  model is created once and kept in the cache directory.
+
+The ONNX backends need `sentence-transformers[onnx]`, install the `onnx` extra.
+
+All backends run a batch on all cores and sort texts by length before
+batching, so short texts are not padded to the length of long ones.
+Quantized models give slightly different vectors, so the backend is part of
+the index cache key. See `benchmarks/embeddings.py` for how much faster they
+are and how close their search results are to those of the full model.
+"""
+import os
+import pathlib
+import platform
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .store import CACHE_DIR
+
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# where quantized ONNX models are kept
+MODELS_DIR = CACHE_DIR / "models"
+
+
+def quantization_config() -> str:
+    """
+    Return the ONNX Runtime quantization config for this CPU.
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    # avx2 runs on every x86 CPU from the last decade
+    return "avx2"
+
+
+def quantized_onnx(model_name: str, model_kwargs: dict) -> pathlib.Path:
+    """
+    Return the directory of the int8 quantized ONNX model, exporting and
+    quantizing it on the first call.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    config = quantization_config()
+    path = MODELS_DIR / model_name.replace("/", "--") / f"onnx-int8-{config}"
+    if not any(path.glob(f"onnx/*_{config}.onnx")):
+        model = SentenceTransformer(
+            model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs
+        )
+        model.save(str(path))
+        export_dynamic_quantized_onnx_model(model, config, str(path))
+    return path
+
+
+def load(model_name: str, backend: str = "torch", threads: int | None = None):
+    """
+    Load the sentence transformer with the backend, running on `threads` cores.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    threads = threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+
+    if backend == "torch" and torch.cuda.is_available():
+        return SentenceTransformer(model_name, model_kwargs={"torch_dtype": torch.float16})
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+    if backend == "torch-int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    kwargs = {"session_options": options, "provider": "CPUExecutionProvider"}
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=kwargs)
+
+    path = quantized_onnx(model_name, kwargs)
+    config = quantization_config()
+    fname = next(path.glob(f"onnx/*_{config}.onnx")).relative_to(path)
+    return SentenceTransformer(
+        str(path), device="cpu", backend="onnx", model_kwargs={**kwargs, "file_name": str(fname)}
+    )
+
+
+class Embedder(Embeddings):
+    """
+    Langchain embeddings of a sentence transformer run by one of `BACKENDS`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = "torch",
+        threads: int | None = None,
+        batch_size: int = 32,
+        normalize: bool = False,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.model = load(model_name, backend, threads)
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.max_seq_length
+
+    def encode(self, texts: list[str], batch_size: int | None = None) -> np.ndarray:
+        """
+        Embed the texts in batches of `batch_size`, returning a float32 matrix.
+        """
+        # sentence transformers sorts the texts by length before batching
+        return self.model.encode(
+            [t.replace("\n", " ") for t in texts],
+            batch_size=batch_size or self.batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
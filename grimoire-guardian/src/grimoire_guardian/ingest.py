@@ -0,0 +1,232 @@
+"""
+Streaming ingestion pipeline.
+
+Documents are parsed in a pool of worker processes. The parent embeds the
+chunks of each document as soon as it has been parsed and adds the vectors to
+the index batch by batch, so parsing and embedding overlap and all cores are
+kept busy. Only a bounded number of parsed documents are in flight at any
+time, which caps peak memory when ingesting many large PDFs.
+
+A document is parsed by a single worker, and all its chunks are held in
+memory until they have been embedded. A single large PDF is therefore not
+parsed any faster, and its peak memory is not capped; split it into several
+files to spread it over the workers.
+
+Workers are started with the spawn method, as forking a process that has
+already loaded torch and its thread pools can deadlock.
+"""
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import time
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from grimoire_guardian import INDEX, ann, get_embedder, load_chunks, metrics
+
+
+# number of tokens embedded per batch for each available core
+TOKENS_PER_CORE = 1024
+
+
+def estimate_tokens(text: str, limit: int) -> int:
+    # roughly four characters per token for english text, and the model never
+    # reads more than `limit` tokens of a chunk anyway
+    return min(len(text) // 4 + 1, limit)
+
+
+def batches(chunks: list, max_tokens: int, limit: int) -> Iterator[list]:
+    """
+    Split chunks into batches of at most `max_tokens` padded tokens.
+
+    Chunks are sorted by length first so each batch holds chunks of similar
+    length and little compute is wasted on padding.
+    """
+    chunks = sorted(chunks, key=lambda c: estimate_tokens(c[0].page_content, limit))
+    batch = []
+    for c in chunks:
+        n = estimate_tokens(c[0].page_content, limit)
+        # every sequence in a batch is padded to the longest one
+        if batch and (len(batch) + 1) * n > max_tokens:
+            yield batch
+            batch = []
+        batch.append(c)
+    if batch:
+        yield batch
+
+
+def parse_one(doc: str) -> tuple[list, float]:
+    """
+    Parse a document in a worker, returning its chunks and how long it took.
+    """
+    start = time.perf_counter()
+    chunks = load_chunks(doc)
+    return chunks, time.perf_counter() - start
+
+
+def parse(docs: Iterable[str], workers: int | None = None, errors: dict | None = None) -> Iterator[tuple[str, list]]:
+    """
+    Parse documents in worker processes, yielding (doc, chunks) as each finishes.
+
+    If `errors` is given, documents that fail to parse are skipped and their
+    exceptions collected in it by document, otherwise the first failure raises.
+    """
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    docs = iter(docs)
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+        # keep a couple of documents queued per worker, but no more, so parsed
+        # chunks waiting for the embedder do not pile up
+        pending = {pool.submit(parse_one, doc): doc for doc in itertools.islice(docs, 2 * workers)}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                doc = pending.pop(f)
+                for nxt in itertools.islice(docs, 1):
+                    pending[pool.submit(parse_one, nxt)] = nxt
+                # the worker's metrics stay in the worker, so record them here
+                try:
+                    chunks, seconds = f.result()
+                except Exception as e:
+                    if errors is None:
+                        raise
+                    errors[doc] = e
+                    continue
+                metrics.observe("stage_seconds", seconds, stage="parsing")
+                yield doc, chunks
+
+
+class Pipeline:
+    """
+    Parse, embed and index documents into `idx`, creating the index if None.
+
+    Vectors are added to the index as batches are embedded. Once `run` has
+    been exhausted all chunks are in `idx`.
+
+    New indexes are created from the `index` settings, see `ann.create`. Types
+    that need training hold back vectors until `train_size` of them have been
+    embedded, train on those and then add vectors as they arrive.
+    """
+
+    def __init__(
+        self,
+        idx: FAISS | None = None,
+        workers: int | None = None,
+        max_tokens: int | None = None,
+        index: dict = INDEX,
+        train_size: int = 50_000,
+    ):
+        self.idx = idx
+        self.workers = workers
+        self.max_tokens = max_tokens or TOKENS_PER_CORE * (os.cpu_count() or 1)
+        self.embedder = get_embedder()
+        self.limit = self.embedder.max_seq_length
+        self.index = index
+        self.train_size = train_size
+        # number of vectors the index created by the pipeline was trained on
+        self.trained = None
+        self._untrained = []
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        # the batch is already sized, so hand it to the model in one go
+        # instead of the fixed batch size embed_documents would use
+        with metrics.timer("embedding_batch"):
+            vectors = self.embedder.encode(texts, batch_size=len(texts))
+        return np.asarray(vectors, dtype=np.float32)
+
+    def add(self, batch: list[tuple[Document, str | None]]):
+        texts = [d.page_content for d, _ in batch]
+        metadatas = [d.metadata for d, _ in batch]
+        ids = [id for _, id in batch]
+        ids = ids if all(ids) else None
+
+        vectors = self.embed(texts)
+        if self.idx is None and self.index["type"] == "flat":
+            self.idx = FAISS.from_embeddings(zip(texts, vectors), self.embedder, metadatas=metadatas, ids=ids)
+        elif self.idx is None:
+            # held back as float32 arrays, as lists of floats take several
+            # times the memory
+            self._untrained.append((texts, vectors, metadatas, ids))
+            if sum(len(t) for t, _, _, _ in self._untrained) >= self.train_size:
+                self.train()
+        else:
+            self.idx.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+
+    def train(self):
+        """
+        Create and train a new index on the vectors held back so far and add them.
+        """
+        vectors = np.concatenate([v for _, v, _, _ in self._untrained])
+        params = {k: v for k, v in self.index.items() if k != "type"}
+        index = ann.create(self.index["type"], vectors.shape[1], len(vectors), **params)
+        ann.train(index, vectors)
+        self.trained = len(vectors)
+
+        self.idx = FAISS(self.embedder, index, InMemoryDocstore(), {})
+        for texts, vectors, metadatas, ids in self._untrained:
+            self.idx.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+        self._untrained = []
+
+    def flush(self, buf: list, final: bool = False) -> list:
+        """
+        Embed and index full batches from `buf`, returning what is left over.
+        """
+        out = list(batches(buf, self.max_tokens, self.limit))
+        if out and not final:
+            # keep the last, possibly small, batch around to fill it up with
+            # chunks of the next document
+            *out, rest = out
+        else:
+            rest = []
+        for batch in out:
+            self.add(batch)
+        return rest
+
+    def add_chunks(self, chunks: list[tuple[Document, str | None]]):
+        """
+        Embed and index (chunk, id) pairs, all of them are in `idx` on return.
+        """
+        self.flush(chunks, final=True)
+        if self._untrained:
+            self.train()
+
+    def run(
+        self,
+        docs: Iterable[str],
+        ids: Callable[[str, list], list[str]] | None = None,
+        errors: dict | None = None,
+    ) -> Iterator[tuple[str, list]]:
+        """
+        Ingest the documents, yielding (doc, chunk ids) as each is parsed.
+
+        `ids` is called with each document and its chunks and returns the ids
+        to store the chunks under, random ids are used if not given. Documents
+        that fail to parse are skipped and collected in `errors` if given, see
+        `parse`.
+        """
+        buf = []
+        tokens = 0
+        for doc, chunks in parse(docs, self.workers, errors):
+            chunk_ids = ids(doc, chunks) if ids else [None] * len(chunks)
+            buf.extend(zip(chunks, chunk_ids))
+            tokens += sum(estimate_tokens(c.page_content, self.limit) for c in chunks)
+            if tokens >= self.max_tokens:
+                buf = self.flush(buf)
+                tokens = sum(estimate_tokens(c.page_content, self.limit) for c, _ in buf)
+            yield doc, chunk_ids
+        self.add_chunks(buf)
+
+
+def ingest(docs: Iterable[str], idx: FAISS | None = None, **kwargs) -> FAISS | None:
+    """
+    Ingest the documents into `idx`, or a new index, and return it.
+    """
+    pipeline = Pipeline(idx, **kwargs)
+    for _ in pipeline.run(docs):
+        pass
+    return pipeline.idx
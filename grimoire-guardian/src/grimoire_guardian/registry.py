@@ -0,0 +1,72 @@
+"""
+Process wide registry of indexes and compiled graphs.
+
+Streamlit runs every browser session in its own thread within the same
+process. Going through the registry means all sessions share one index and
+one compiled graph per document instead of each building their own.
+"""
+import pathlib
+import threading
+import time
+
+from grimoire_guardian import create_index, graph, metrics
+
+
+class Registry:
+    """
+    Thread-safe lazy cache of indexes and compiled graphs keyed by document.
+
+    Each entry is built at most once, concurrent callers asking for an entry
+    that is being built wait for it instead of building their own copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._building = {}
+        self._indexes = {}
+        self._graphs = {}
+
+    @staticmethod
+    def key(doc) -> str:
+        return str(pathlib.Path(doc).resolve())
+
+    def _get(self, cache: dict, key: str, build):
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            lock = self._building.setdefault((id(cache), key), threading.Lock())
+        start = time.perf_counter()
+        with lock:
+            if key not in cache:
+                cache[key] = build()
+            else:
+                # someone else built it while we waited
+                metrics.observe("queue_wait_seconds", time.perf_counter() - start, queue="registry")
+            return cache[key]
+
+    def index(self, doc):
+        """
+        Return the shared index for the document, creating it on first use.
+        """
+        return self._get(self._indexes, self.key(doc), lambda: create_index(doc))
+
+    def graph(self, doc):
+        """
+        Return the shared compiled graph for the document, creating it on first use.
+        """
+        return self._get(self._graphs, self.key(doc), lambda: graph(self.index(doc)))
+
+    def evict(self, doc):
+        """
+        Drop the index and graph of the document, they are rebuilt on next use.
+        """
+        key = self.key(doc)
+        with self._lock:
+            self._indexes.pop(key, None)
+            self._graphs.pop(key, None)
+
+
+registry = Registry()
@@ -0,0 +1,218 @@
+"""
+Semantic cache of answers.
+
+Users keep asking the same questions about a document, worded a little
+differently each time. Answers are cached together with the embedding of the
+question, and a new question gets the cached answer when its embedding is
+close enough to that of a cached question, without searching the index or
+calling the LLM. Close is not good enough for names and numbers, "what does
+the spell Lumos do" is not "what does the spell Nox do", so apart from filler
+words the two questions have to use the same words.
+
+Answers are scoped to the version of the index they were given for, and to
+the settings that shape an answer, see `settings_version`, so rebuilding or
+refreshing an index or changing the model or prompt never serves stale
+answers.
+The least recently used answers are evicted when the cache is full, and the
+cache is kept in a SQLite database so it survives restarts.
+"""
+import collections
+import hashlib
+import json
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from .cache import normalize
+from .store import CACHE_DIR
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    scope TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (scope, query)
+);
+"""
+
+# words that can differ between two questions with the same answer
+FILLER = frozenset(
+    "a an the is are was were be been do does did can could would should will "
+    "of in on at to for from by with about into it its this that me my i you "
+    "your please tell explain describe give say s".split()
+)
+
+_fingerprints = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def entities(query: str) -> frozenset[str]:
+    """
+    Return the words of the question that are not filler, the names, numbers
+    and question words an answer depends on.
+    """
+    return frozenset(w for w in re.findall(r"\w+", query.lower()) if w not in FILLER)
+
+
+def settings_version(**settings) -> str:
+    """
+    Return a hash of the settings an answer depends on besides the index,
+    like the chat model, the system prompt and the context budget.
+    """
+    data = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def index_version(idx, version: int) -> str:
+    """
+    Return a version of the index that is stable across processes.
+
+    It is the hash of the ids of the indexed chunks. `version` is the in
+    process version of the index, see `QueryCache.version`, and is only used to
+    know when the hash has to be computed again.
+    """
+    with _lock:
+        cached = _fingerprints.get(idx)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    h = hashlib.sha256()
+    for i in range(len(idx.index_to_docstore_id)):
+        h.update(idx.index_to_docstore_id[i].encode())
+        h.update(b"\0")
+    fp = h.hexdigest()[:16]
+    with _lock:
+        _fingerprints[idx] = (version, fp)
+    return fp
+
+
+def _unit(e) -> np.ndarray:
+    e = np.asarray(e, dtype=np.float32)
+    n = np.linalg.norm(e)
+    return e / n if n else e
+
+
+class SemanticCache:
+    """
+    Similarity matched answer cache, safe to share between threads.
+
+    A cached answer is only served for a question with the same `entities`.
+    Pass `path=None` to keep the cache in memory only.
+    """
+
+    def __init__(self, path=CACHE_DIR / "answers.sqlite", threshold: float = 0.95, maxsize: int = 1000):
+        self.path = None if path is None else pathlib.Path(path)
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # (scope, query) -> (embedding, answer), least recently used first
+        self._entries = None
+        # scope -> (queries, matrix of their embeddings)
+        self._matrices = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def entries(self) -> collections.OrderedDict:
+        # load on first use so importing the module does not touch the disk
+        if self._entries is None:
+            self._entries = collections.OrderedDict()
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(SCHEMA)
+                rows = db.execute(
+                    "SELECT scope, query, embedding, answer FROM answers ORDER BY used"
+                ).fetchall()
+                for scope, query, e, answer in rows:
+                    self._entries[(scope, query)] = (np.frombuffer(e, dtype=np.float32), answer)
+                self._db = db
+        return self._entries
+
+    def _matrix(self, scope: str):
+        if scope not in self._matrices:
+            keys = [k for k in self.entries if k[0] == scope]
+            m = np.stack([self._entries[k][0] for k in keys]) if keys else None
+            self._matrices[scope] = (keys, m)
+        return self._matrices[scope]
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE scope = ? AND query = ?", key)
+
+    def get(self, scope: str, query: str, embedding) -> str | None:
+        """
+        Return the answer to the most similar question asked in the scope, if
+        it is similar enough.
+        """
+        with self._lock:
+            key = (scope, normalize(query))
+            if key not in self.entries:
+                keys, m = self._matrix(scope)
+                key = None
+                if m is not None:
+                    scores = m @ _unit(embedding)
+                    words = entities(query)
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.threshold:
+                            break
+                        if entities(keys[i][1]) == words:
+                            key = keys[i]
+                            break
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute(
+                    "UPDATE answers SET used = ? WHERE scope = ? AND query = ?", (time.time(), *key)
+                )
+            return self._entries[key][1]
+
+    def put(self, scope: str, query: str, embedding, answer: str):
+        """
+        Cache the answer to the question in the scope.
+        """
+        e = _unit(embedding)
+        key = (scope, normalize(query))
+        with self._lock:
+            entries = self.entries
+            entries[key] = (e, answer)
+            entries.move_to_end(key)
+            self._matrices.pop(scope, None)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                    (*key, e.tobytes(), answer, time.time()),
+                )
+            while len(entries) > self.maxsize:
+                self._drop(next(iter(entries)))
+
+    def discard(self, scope: str):
+        """
+        Drop all answers in the scope.
+        """
+        with self._lock:
+            for key in [k for k in self.entries if k[0] == scope]:
+                self._drop(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries or ()),
+        }
@@ -0,0 +1,167 @@
+"""
+Content addressed on-disk store for FAISS indexes.
+
+Every entry is keyed by the hash of the source document together with the
+chunking settings and the embedding model, so changing any of them simply
+misses the cache instead of returning a stale index. An entry is a directory
+holding the raw FAISS index, the docstore and some metadata about how it was
+built.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+
+CACHE_DIR = pathlib.Path(
+    os.environ.get("GRIMOIRE_CACHE_DIR", "~/.cache/grimoire-guardian")
+).expanduser()
+
+# bump when the on-disk layout changes so old entries are ignored
+FORMAT = 1
+
+
+def file_digest(path, chunk_size: int = 1 << 20) -> str:
+    """
+    Return the sha256 hex digest of the file contents.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(chunk_size), b""):
+            h.update(b)
+    return h.hexdigest()
+
+
+def index_key(digest: str, **settings) -> str:
+    """
+    Return the cache key for a document digest and the settings used to index it.
+    """
+    payload = json.dumps(
+        {"format": FORMAT, "digest": digest, **settings}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def save_index(path, idx: FAISS, meta: dict | None = None):
+    """
+    Save the index to the directory `path`, replacing it if it exists.
+
+    Everything is written to a temporary directory next to `path` first and
+    moved into place, so readers never see a half written index.
+    """
+    import faiss
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(dir=path.parent, prefix=".tmp-"))
+    try:
+        faiss.write_index(idx.index, str(tmp / "index.faiss"))
+
+        ids = [idx.index_to_docstore_id[i] for i in range(len(idx.index_to_docstore_id))]
+        docs = {}
+        for id in ids:
+            doc = idx.docstore.search(id)
+            docs[id] = {"page_content": doc.page_content, "metadata": doc.metadata}
+        with open(tmp / "docstore.json", "w") as f:
+            json.dump({"ids": ids, "docs": docs}, f, default=str)
+
+        with open(tmp / "meta.json", "w") as f:
+            json.dump({"format": FORMAT, "ntotal": idx.index.ntotal, **(meta or {})}, f)
+
+        # directories can not be atomically replaced, move the old one aside first
+        old = None
+        if path.exists():
+            old = path.with_name(f".old-{path.name}-{os.getpid()}")
+            os.replace(path, old)
+        os.replace(tmp, path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def load_index(path, embedder, mmap: bool = True) -> FAISS:
+    """
+    Load an index saved with `save_index`.
+
+    With `mmap` the vectors are memory mapped read-only instead of read into
+    memory, which makes loading close to free and lets processes share pages.
+    Load with `mmap=False` if the index is going to be modified.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    path = pathlib.Path(path)
+    fname = str(path / "index.faiss")
+    if not mmap:
+        index = faiss.read_index(fname)
+    else:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        try:
+            # newer faiss can also map the codes of flat indexes
+            index = faiss.read_index(fname, flags | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+        except RuntimeError:
+            # but not together with inverted lists, map only those for IVF
+            index = faiss.read_index(fname, flags)
+
+    with open(path / "docstore.json") as f:
+        data = json.load(f)
+    docstore = InMemoryDocstore(
+        {id: Document(id=id, **doc) for id, doc in data["docs"].items()}
+    )
+    return FAISS(
+        embedding_function=embedder,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(data["ids"])),
+    )
+
+
+def read_meta(path) -> dict | None:
+    """
+    Return the metadata of the index at `path`, or None if there is no valid index.
+    """
+    try:
+        with open(pathlib.Path(path) / "meta.json") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get("format") == FORMAT else None
+
+
+class IndexStore:
+    """
+    Directory of indexes keyed by `index_key`.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = pathlib.Path(root)
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.root / "indexes" / key
+
+    def get(self, key: str, embedder, mmap: bool = True) -> FAISS | None:
+        """
+        Return the index stored under `key`, or None on a cache miss.
+        """
+        path = self.path(key)
+        if read_meta(path) is None:
+            return None
+        return load_index(path, embedder, mmap=mmap)
+
+    def put(self, key: str, idx: FAISS, **meta):
+        """
+        Store the index under `key` together with any extra metadata.
+        """
+        save_index(self.path(key), idx, {"key": key, **meta})
@@ -1,9 +1,14 @@
-import mlflow
-from mlflow.types.responses import ResponsesAgentRequest
-from . import stormy
+from . import metrics
 import sys
 
 def main():
+    metrics.setup()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from . import batch
+
+        batch.main(sys.argv[2:])
+        return
+
     # Get location from command line argument or use default
     if len(sys.argv) > 1:
         location = " ".join(sys.argv[1:])  # Join all arguments in case of spaces
@@ -11,6 +16,11 @@ def main():
         location = "Biskop Gunnerus gate 14"
     
     print(f"🌦️ Getting weather information for: {location}")
+
+    # mlflow and the agent are slow to import, so only when they are needed
+    import mlflow
+    from mlflow.types.responses import ResponsesAgentRequest
+    from . import stormy
     
     request = ResponsesAgentRequest(
         input=[
@@ -21,13 +31,15 @@ def main():
         ]
     )
     mlflow.openai.autolog()
-    agent = stormy.create_agent()
-    response = agent.predict(request)
+    agent = stormy.create_agent(planner=True, cache=stormy.RESPONSE_CACHE)
     print("\n🤖 Stormy McWeatherface:")
-    for output in response.output:
-        if output.type == 'message':
-            content = output.content
-            if content:
-                print(content[0].get('text', ''))
-        elif 'content' in output:
-            print(output['content'])
\ No newline at end of file
+    # print the answer as it is generated
+    for event in agent.predict_stream(request):
+        if event.type == "response.output_text.delta":
+            print(event.delta, end="", flush=True)
+        elif event.type == "response.output_item.done":
+            output = event.item
+            if output["type"] == "message":
+                print()
+            elif output.get("content"):
+                print(output["content"])
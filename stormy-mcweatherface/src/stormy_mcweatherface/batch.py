@@ -0,0 +1,239 @@
+"""
+Weather for many locations at once, without going through the LLM.
+
+Addresses are read from a CSV or Parquet file, geocoded through the geocode
+cache (new addresses at the pace Nominatim allows), grouped into forecast grid
+cells so every cell is fetched once, and the forecasts are fetched concurrently.
+The results are written to CSV, Parquet or JSON lines:
+
+    stormy-mcweatherface batch addresses.csv forecasts.parquet
+
+Narrative summaries written by the LLM are optional, one per grid cell:
+
+    stormy-mcweatherface batch addresses.csv forecasts.jsonl --narrate
+
+LLM calls that are rate limited or hit a server error are retried with
+exponential backoff. A cell whose narrative still fails gets a
+`narrative_error` instead, and the rest of the results are written as usual.
+"""
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import backoff
+
+from . import geocache, metrics, weather
+
+
+# number of forecasts fetched at a time, met.no asks for at most 20 requests per second
+CONCURRENCY = 10
+
+# attempts per narrative before giving up on it
+NARRATE_TRIES = 5
+
+NARRATE_PROMPT = "You are Stormy McWeatherface. Summarize the weather forecast in the JSON below in two or three sentences for a logistics planner, mention anything that could delay deliveries."
+
+
+def read_addresses(path, column: str = "address") -> list[str]:
+    """
+    Read the addresses in `column` of a CSV or Parquet file.
+    """
+    import pandas as pd
+
+    path = pathlib.Path(path)
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path, columns=[column])
+    else:
+        df = pd.read_csv(path, usecols=[column], dtype=str)
+    return df[column].dropna().astype(str).tolist()
+
+
+async def geocode(addresses: list[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Geocode the distinct addresses, returning the result per normalized address.
+
+    Cached addresses are answered at once, the others are spaced out by the
+    Nominatim rate limiter.
+    """
+    queries = {}
+    for address in addresses:
+        queries.setdefault(geocache.normalize(address), address)
+    results = await asyncio.gather(*(weather.get_geocode_location(q) for q in queries.values()))
+    return dict(zip(queries, results))
+
+
+async def forecasts(cells, concurrency: int = CONCURRENCY) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Fetch the forecast summary of each grid cell, `concurrency` at a time.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(cell):
+        async with sem:
+            return await weather.get_weather_summary(*cell)
+
+    cells = list(cells)
+    results = await asyncio.gather(*(fetch(c) for c in cells))
+    return dict(zip(cells, results))
+
+
+async def narrate(
+    summaries: Dict[tuple, Dict[str, Any]],
+    client=None,
+    concurrency: int = 4,
+    errors: Optional[Dict[tuple, str]] = None,
+) -> Dict[tuple, str]:
+    """
+    Write a short narrative summary of each forecast with the LLM.
+
+    Rate limits, connection and server errors are retried up to NARRATE_TRIES
+    times. If `errors` is given, cells that still fail are left out of the
+    result and their error is stored in it, otherwise the first error is raised.
+    """
+    # the agent module pulls in mlflow and openai, only load them when narrating
+    import openai
+
+    if client is None:
+        from . import stormy
+
+        client = stormy.create_async_client()
+    sem = asyncio.Semaphore(concurrency)
+
+    @backoff.on_exception(
+        backoff.expo,
+        (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError),
+        max_tries=NARRATE_TRIES,
+    )
+    async def write(summary):
+        async with sem:
+            response = await client.chat.completions.create(
+                model="data-science-gpt-4o",
+                messages=[
+                    {"role": "system", "content": NARRATE_PROMPT},
+                    {"role": "user", "content": json.dumps(summary, separators=(",", ":"))},
+                ],
+            )
+        return response.choices[0].message.content
+
+    cells = [c for c, s in summaries.items() if s.get("success")]
+    texts = await asyncio.gather(*(write(summaries[c]) for c in cells), return_exceptions=True)
+    narratives = {}
+    for cell, text in zip(cells, texts):
+        if not isinstance(text, Exception):
+            narratives[cell] = text
+            continue
+        metrics.inc("narrate_errors_total", error=type(text).__name__)
+        if errors is None:
+            raise text
+        errors[cell] = f"{type(text).__name__}: {text}"
+    return narratives
+
+
+async def run(addresses: list[str], concurrency: int = CONCURRENCY, llm: bool = False) -> list[Dict[str, Any]]:
+    """
+    Return the forecast for every address, in order.
+
+    Each result holds the geocoding result, the grid cell the forecast is
+    for, the forecast summary (see `summary.summarize`) and, if `llm` is set,
+    a narrative summary, or the error that kept it from being written.
+    """
+    locations = await geocode(addresses)
+
+    cells = {}
+    for key, loc in locations.items():
+        if loc.get("success"):
+            cells[key] = weather.FORECAST_CACHE.cell(loc["latitude"], loc["longitude"])
+    summaries = await forecasts(set(cells.values()), concurrency)
+    narrative_errors = {}
+    narratives = await narrate(summaries, errors=narrative_errors) if llm else {}
+
+    rows = []
+    for address in addresses:
+        key = geocache.normalize(address)
+        loc = locations[key]
+        row = {"address": address, **loc}
+        if key in cells:
+            cell = cells[key]
+            row["cell"] = list(cell)
+            row["forecast"] = summaries[cell]
+            row["success"] = summaries[cell].get("success", False)
+            if cell in narratives:
+                row["narrative"] = narratives[cell]
+            elif cell in narrative_errors:
+                row["narrative_error"] = narrative_errors[cell]
+        rows.append(row)
+    return rows
+
+
+def flatten(row: Dict[str, Any], days: int = 3) -> Dict[str, Any]:
+    """
+    Flatten a result to a single table row, with the current conditions and
+    the first `days` days of the daily forecast as columns.
+    """
+    out = {k: row.get(k) for k in ("address", "success", "error", "location", "latitude", "longitude")}
+    forecast = row.get("forecast") or {}
+    if not out["error"]:
+        out["error"] = forecast.get("error")
+    for k, v in (forecast.get("current") or {}).items():
+        out[f"current_{k}"] = v
+    for i, day in enumerate((forecast.get("daily") or [])[:days]):
+        for k, v in day.items():
+            out[f"day{i}_{k}"] = v
+    for k in ("narrative", "narrative_error"):
+        if k in row:
+            out[k] = row[k]
+    return out
+
+
+def write(rows: list[Dict[str, Any]], path):
+    """
+    Write the results to `path`, as JSON lines if it ends in .jsonl, otherwise
+    flattened to a CSV or Parquet table.
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".jsonl":
+        with open(path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+
+    import pandas as pd
+
+    df = pd.DataFrame([flatten(r) for r in rows])
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="stormy-mcweatherface batch",
+        description="Get the weather for every address in a CSV or Parquet file.",
+    )
+    parser.add_argument("input", help="CSV or Parquet file with addresses")
+    parser.add_argument("output", help="output file, .csv, .parquet or .jsonl")
+    parser.add_argument("--column", default="address", help="column with the addresses")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="forecasts fetched at a time")
+    parser.add_argument("--narrate", action="store_true", help="add narrative summaries written by the LLM")
+    args = parser.parse_args(argv)
+    metrics.setup()
+
+    addresses = read_addresses(args.input, args.column)
+    print(f"🌦️ Getting weather for {len(addresses)} addresses")
+    start = time.perf_counter()
+    rows = asyncio.run(run(addresses, args.concurrency, args.narrate))
+    write(rows, args.output)
+    ok = sum(1 for r in rows if r.get("success"))
+    print(f"✅ {ok}/{len(rows)} forecasts written to {args.output} in {time.perf_counter() - start:.1f}s")
+    failed = sum(1 for r in rows if "narrative_error" in r)
+    if failed:
+        print(f"⚠️ {failed} addresses are missing a narrative, see the narrative_error column")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
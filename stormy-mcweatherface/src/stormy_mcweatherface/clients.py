@@ -0,0 +1,113 @@
+"""
+Shared HTTP client for the agent tools.
+
+Creating a new client per request means paying for a TCP and TLS handshake on
+every tool call. Instead there is one long-lived, connection pooled HTTP/2
+client per event loop, and a bounded number of requests in flight at a time.
+
+Async code awaits the tools directly on its own loop. Sync code, like the tool
+functions the agent calls, runs them on a shared background loop through `run`
+instead of starting a new event loop per call with `asyncio.run`.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+
+from . import metrics
+
+
+TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+
+# maximum number of requests in flight per event loop
+MAX_CONCURRENCY = 10
+
+_lock = threading.Lock()
+_clients = weakref.WeakKeyDictionary()
+_loop = None
+
+
+def _get() -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    # httpx clients and semaphores are bound to the loop they are first used
+    # on, so keep one of each per loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _clients:
+            client = httpx.AsyncClient(http2=True, timeout=TIMEOUT, limits=LIMITS)
+            _clients[loop] = (client, asyncio.Semaphore(MAX_CONCURRENCY))
+        return _clients[loop]
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared client for the running event loop.
+    """
+    return _get()[0]
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """
+    GET the url with the shared client, waiting for a free slot if too many
+    requests are in flight.
+    """
+    client, sem = _get()
+    start = time.perf_counter()
+    async with sem:
+        metrics.observe("queue_wait_seconds", time.perf_counter() - start, queue="http")
+        with metrics.timer("http", host=httpx.URL(url).host):
+            return await client.get(url, **kwargs)
+
+
+class RateLimiter:
+    """
+    Spaces out calls to at most `rate` per second, across all threads and loops.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the background event loop used by `run`, starting it on first use.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="stormy-http", daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """
+    Run the coroutine on the background event loop and wait for its result.
+
+    Safe to call from any thread, including threads that run an event loop of
+    their own.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, background_loop()).result()
+
+
+async def aclose():
+    """
+    Close the client of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _clients.pop(loop, None)
+    if entry is not None:
+        await entry[0].aclose()
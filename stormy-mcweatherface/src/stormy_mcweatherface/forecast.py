@@ -0,0 +1,153 @@
+"""
+Cache of met.no forecasts.
+
+met.no asks clients to respect the `Expires` header and to revalidate with
+`If-Modified-Since` instead of downloading the same forecast again. The cache
+keys forecasts by grid cell, serves them locally until they expire, then
+revalidates them with a conditional request. Concurrent requests for the same
+cell share a single upstream request.
+
+If met.no fails or rate limits us, an expired forecast is served rather than
+nothing at all. Failures are logged and counted in the
+`forecast_errors_total` metric by reason.
+"""
+import asyncio
+import collections
+import email.utils
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+
+# number of decimals coordinates are rounded to, 2 decimals is about a kilometre
+PRECISION = 2
+
+# how long to keep a forecast if met.no does not say
+DEFAULT_TTL = 300
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class ForecastCache:
+    """
+    Grid cell keyed forecast cache, safe to share between threads and event loops.
+    """
+
+    def __init__(self, precision: int = PRECISION, maxsize: int = 10_000):
+        self.precision = precision
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        # cell -> (data, expires, last modified)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # futures are bound to their loop, so in-flight requests are per loop
+        self._inflight = weakref.WeakKeyDictionary()
+
+    def cell(self, lat: float, lon: float) -> tuple[float, float]:
+        """
+        Return the grid cell of the coordinates, forecasts are shared within a cell.
+        """
+        return round(lat, self.precision), round(lon, self.precision)
+
+    def expires(self, lat: float, lon: float) -> Optional[float]:
+        """
+        Return when the cached forecast for the coordinates expires, if there is one.
+        """
+        entry = self._entries.get(self.cell(lat, lon))
+        return entry[1] if entry else None
+
+    def _store(self, cell, data, expires, last_modified):
+        with self._lock:
+            self._entries[cell] = (data, expires, last_modified)
+            self._entries.move_to_end(cell)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def get(
+        self,
+        lat: float,
+        lon: float,
+        fetch: Callable[[float, float, dict], Awaitable[httpx.Response]],
+    ) -> Optional[Any]:
+        """
+        Return the forecast for the coordinates.
+
+        `fetch` is called with the coordinates of the grid cell and any extra
+        request headers when the forecast has to be fetched or revalidated.
+        """
+        cell = self.cell(lat, lon)
+        entry = self._entries.get(cell)
+        if entry is not None and entry[1] > time.time():
+            self.hits += 1
+            return entry[0]
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inflight = self._inflight.setdefault(loop, {})
+            task = inflight.get(cell)
+            if task is None:
+                self.misses += 1
+                task = inflight[cell] = loop.create_task(self._refresh(cell, entry, fetch))
+                task.add_done_callback(lambda _: inflight.pop(cell, None))
+        # shield so one caller being cancelled does not cancel the others
+        return await asyncio.shield(task)
+
+    async def _refresh(self, cell, entry, fetch) -> Optional[Any]:
+        headers = {}
+        if entry is not None and entry[2]:
+            headers["If-Modified-Since"] = entry[2]
+
+        stale = entry[0] if entry is not None else None
+        try:
+            response = await fetch(*cell, headers)
+        except httpx.HTTPError as e:
+            log.warning("met.no request for %s failed: %s", cell, e)
+            metrics.inc("forecast_errors_total", reason="request")
+            return stale
+
+        expires = _parse_date(response.headers.get("Expires")) or time.time() + DEFAULT_TTL
+        if response.status_code == 200:
+            data = response.json()
+            self._store(cell, data, expires, response.headers.get("Last-Modified"))
+            return data
+        elif response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            self._store(cell, entry[0], expires, entry[2])
+            return entry[0]
+        elif response.status_code == 403:
+            log.error("met.no refused the request, set a User-Agent with a real app name and contact info")
+            metrics.inc("forecast_errors_total", reason="forbidden")
+        elif response.status_code == 429:
+            log.warning("met.no is rate limiting us, serving %s forecast", "a stale" if stale is not None else "no")
+            metrics.inc("forecast_errors_total", reason="rate_limited")
+        else:
+            log.warning("met.no returned HTTP %s for %s", response.status_code, cell)
+            metrics.inc("forecast_errors_total", reason=f"http_{response.status_code}")
+        return stale
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
@@ -0,0 +1,312 @@
+"""
+Persistent cache of geocoding results.
+
+Nominatim allows about one request per second, and most addresses we look up
+have been looked up before. Results are kept in a SQLite database keyed by the
+normalized query, with an in-memory LRU in front of it, so repeated lookups
+never touch the network.
+
+Queries that differ only slightly from a cached one ("Youngstorget 3, Oslo"
+vs "Youngstorgt 3 Oslo.") are matched fuzzily, as long as every word matches
+its counterpart, and results can be looked up in reverse by coordinates. The
+cache can be filled offline from an exported address list:
+
+    python -m stormy_mcweatherface.geocache preload addresses.csv
+
+where the CSV has the columns `query`, `latitude`, `longitude` and optionally
+`location`.
+"""
+import collections
+import csv
+import difflib
+import math
+import os
+import pathlib
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+
+CACHE_DIR = pathlib.Path(
+    os.environ.get("STORMY_CACHE_DIR", "~/.cache/stormy-mcweatherface")
+).expanduser()
+
+# size of the grid cells used for reverse lookups, in degrees
+CELL = 0.01
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocode (
+    query TEXT PRIMARY KEY,
+    location TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS geocode_cell ON geocode (cell_lat, cell_lon);
+CREATE TABLE IF NOT EXISTS grams (
+    gram TEXT NOT NULL,
+    query TEXT NOT NULL,
+    PRIMARY KEY (gram, query)
+) WITHOUT ROWID;
+"""
+
+
+def normalize(query: str) -> str:
+    """
+    Normalize a query so different spellings of the same address share an entry.
+    """
+    query = unicodedata.normalize("NFKC", query).lower()
+    return " ".join(re.sub(r"[^\w]+", " ", query).split())
+
+
+def distance(a: str, b: str) -> int:
+    """
+    Return the Levenshtein distance between two words.
+    """
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def same_words(a: str, b: str) -> bool:
+    """
+    Return whether two normalized queries have the same words, allowing a typo
+    in longer words. Numbers have to match exactly.
+
+    "Nordre gate 5" is not "Søndre gate 5" or "Nedre gate 5", however similar
+    the whole strings are.
+    """
+    a, b = a.split(), b.split()
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x == y:
+            continue
+        if x.isdigit() or y.isdigit() or len(x) < 5 or distance(x, y) > (1 if len(x) < 9 else 2):
+            return False
+    return True
+
+
+def trigrams(query: str) -> set[str]:
+    q = f"  {query} "
+    return {q[i : i + 3] for i in range(len(q) - 2)}
+
+
+class GeocodeCache:
+    """
+    SQLite backed geocode cache, safe to share between threads.
+
+    Entries are stored in the format returned by `get_geocode_location`.
+    """
+
+    def __init__(self, path=CACHE_DIR / "geocode.sqlite", threshold: float = 0.9, memory_size: int = 10_000):
+        self.path = pathlib.Path(path)
+        self.threshold = threshold
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # connect on first use so importing the module does not touch the disk
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _result(row) -> Dict[str, Any]:
+        return {"success": True, "location": row[0], "latitude": row[1], "longitude": row[2]}
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached result for the query, or None.
+        """
+        key = normalize(query)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return dict(self._memory[key])
+            row = self.db.execute(
+                "SELECT location, latitude, longitude FROM geocode WHERE query = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._remember(key, self._result(row))
+            return self._result(row)
+
+    def fuzzy(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the result of the most similar cached query, if similar enough.
+
+        Every word has to match, see `same_words`. Fuzzy hits are not
+        remembered under the new spelling, so a wrong match does not turn
+        into an exact one.
+        """
+        key = normalize(query)
+        grams = list(trigrams(key))
+        if not grams:
+            return None
+
+        with self._lock:
+            rows = self.db.execute(
+                f"""
+                SELECT query, COUNT(*) AS n FROM grams
+                WHERE gram IN ({",".join("?" * len(grams))})
+                GROUP BY query ORDER BY n DESC LIMIT 20
+                """,
+                grams,
+            ).fetchall()
+
+            best, score = None, self.threshold
+            for candidate, _ in rows:
+                if not same_words(key, candidate):
+                    continue
+                ratio = difflib.SequenceMatcher(None, key, candidate).ratio()
+                if ratio >= score:
+                    best, score = candidate, ratio
+            if best is None:
+                return None
+
+            row = self.db.execute(
+                "SELECT location, latitude, longitude FROM geocode WHERE query = ?", (best,)
+            ).fetchone()
+            return self._result(row)
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached result for the query, falling back to a fuzzy match.
+        """
+        result = self.get(query) or self.fuzzy(query)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, query: str, result: Dict[str, Any]):
+        """
+        Cache a successful geocoding result for the query.
+        """
+        self.put_many([(query, result)])
+
+    def put_many(self, items):
+        """
+        Cache many (query, result) pairs in a single transaction.
+        """
+        now = time.time()
+        rows, grams = [], []
+        for query, result in items:
+            key = normalize(query)
+            lat, lon = float(result["latitude"]), float(result["longitude"])
+            rows.append((
+                key, result.get("location", query), lat, lon,
+                math.floor(lat / CELL), math.floor(lon / CELL), now,
+            ))
+            grams.extend((g, key) for g in trigrams(key))
+
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN")
+            try:
+                db.executemany("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                db.executemany("INSERT OR IGNORE INTO grams VALUES (?, ?)", grams)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            for row in rows:
+                self._remember(row[0], self._result(row[1:4]))
+
+    def reverse(self, lat: float, lon: float, limit: int = 1) -> list[Dict[str, Any]]:
+        """
+        Return up to `limit` cached results closest to the coordinates.
+
+        Only results in the grid cells around the coordinates, roughly a
+        kilometre in each direction, are considered.
+        """
+        clat, clon = math.floor(lat / CELL), math.floor(lon / CELL)
+        with self._lock:
+            rows = self.db.execute(
+                """
+                SELECT location, latitude, longitude FROM geocode
+                WHERE cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?
+                """,
+                (clat - 1, clat + 1, clon - 1, clon + 1),
+            ).fetchall()
+        rows.sort(key=lambda r: (r[1] - lat) ** 2 + ((r[2] - lon) * math.cos(math.radians(lat))) ** 2)
+        # the same place is often cached under several spellings
+        seen, out = set(), []
+        for r in rows:
+            if r[0] not in seen:
+                seen.add(r[0])
+                out.append(self._result(r))
+        return out[:limit]
+
+    def stats(self) -> dict:
+        """
+        Return the hits and misses of `lookup`.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._memory),
+        }
+
+    def preload(self, path, batch_size: int = 10_000) -> int:
+        """
+        Load an exported address list into the cache, returning the number of rows.
+        """
+        n = 0
+        with open(path, newline="") as f:
+            batch = []
+            for row in csv.DictReader(f):
+                batch.append((row["query"], {
+                    "location": row.get("location") or row["query"],
+                    "latitude": row["latitude"],
+                    "longitude": row["longitude"],
+                }))
+                if len(batch) >= batch_size:
+                    self.put_many(batch)
+                    n += len(batch)
+                    batch = []
+            if batch:
+                self.put_many(batch)
+                n += len(batch)
+        return n
+
+
+def main() -> None:
+    if len(sys.argv) != 3 or sys.argv[1] != "preload":
+        print("usage: python -m stormy_mcweatherface.geocache preload <addresses.csv>")
+        sys.exit(1)
+    n = GeocodeCache().preload(sys.argv[2])
+    print(f"📍 Preloaded {n} addresses")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,38 @@
 import gradio as gr
 import mlflow
 import asyncio
+import os
 import signal
 import threading
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from mlflow.types.responses import ResponsesAgentRequest
-from . import stormy
+from . import metrics, stormy
 
 
-def get_weather_response(location: str) -> str:
-    """Get weather response from the agent for a given location"""
+# number of requests handled at a time, and so the number of agents
+CONCURRENCY = int(os.environ.get("STORMY_CONCURRENCY", 4))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> stormy.AgentPool:
+    """Return the app's agent pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            mlflow.openai.autolog()
+            _pool = stormy.AgentPool(CONCURRENCY, planner=True, cache=stormy.RESPONSE_CACHE)
+        return _pool
+
+
+def get_weather_response(location: str):
+    """Stream the weather response from the agent for a given location"""
     if not location.strip():
-        return "Please enter a location!"
+        yield "Please enter a location!"
+        return
     
     try:
-        # Create the agent
-        mlflow.openai.autolog()
-        agent = stormy.create_agent()
-        
         # Create request
         request = ResponsesAgentRequest(
             input=[
@@ -28,24 +43,22 @@ def get_weather_response(location: str) -> str:
             ]
         )
         
-        # Get response from agent
-        response = agent.predict(request)
-        
-        # Extract text from response
+        # Render the answer as it is generated
+        result = ""
+        with get_pool().agent() as agent:
+            for event in agent.predict_stream(request):
+                if event.type == "response.output_text.delta":
+                    result += event.delta
+                    yield result
+                elif event.type == "response.output_item.done" and event.item["type"] == "function_call_output":
+                    # text streamed before a tool call was not the answer
+                    result = ""
 
-        for output in response.output:
-            if output.type == 'message':
-                content = output.content
-                if content:
-                    result = content[0].get('text', '')
-            elif 'content' in output:
-                result = output['content']
-
-        
-        return result if result else "I couldn't get a response from the agent."
+        if not result:
+            yield "I couldn't get a response from the agent."
         
     except Exception as e:
-        return f"❌ Error: {str(e)}"
+        yield f"❌ Error: {str(e)}"
 
 
 def create_gradio_interface():
@@ -87,7 +100,11 @@ def create_gradio_interface():
 
 def launch_app(share=False, debug=False):
     """Launch the Gradio app"""
+    metrics.setup()
+    # create the agents up front so the first requests do not wait for them
+    get_pool()
     interface = create_gradio_interface()
+    interface.queue(default_concurrency_limit=CONCURRENCY)
     interface.launch(share=share, debug=debug)
 
 
@@ -0,0 +1,274 @@
+"""
+Latency, token and cache metrics.
+
+Stages of a request, like LLM calls, tool calls, retrieval or HTTP requests,
+are timed into histograms labelled with the stage, tokens used by the LLM and
+other events are counted, and caches report their hit rates.
+
+Metrics are exported in the Prometheus text format and as a JSON report with
+percentiles per stage. Set `<NAMESPACE>_METRICS_PORT`, e.g.
+`STORMY_METRICS_PORT`, to serve both over HTTP at `/metrics` and `/report`,
+and `<NAMESPACE>_METRICS_REPORT` to write the JSON report to that path when
+the process exits.
+
+grimoire-guardian, stormy-mcweatherface and git-happens each ship this module,
+identical apart from the namespace of METRICS, as they are installed on their
+own. `benchmarks/check_metrics.py` checks that the copies have not drifted
+apart, so change all three together.
+"""
+import atexit
+import contextlib
+import functools
+import http.server
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Callable
+
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# number of recent observations kept per histogram for the percentiles in the report
+SAMPLES = 2048
+
+
+def _escape(value) -> str:
+    # label values may hold paths, tool names or error messages
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Histogram:
+    """
+    Prometheus style histogram, which also keeps the most recent observations
+    to compute percentiles.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._samples = []
+
+    def observe(self, value: float):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        if len(self._samples) < SAMPLES:
+            self._samples.append(value)
+        else:
+            self._samples[self.count % SAMPLES] = value
+
+    def quantile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        s = sorted(self._samples)
+        return s[min(len(s) - 1, int(q * len(s)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of histograms, counters and cache statistics.
+
+    Metric names are prefixed with `namespace`, and `setup` reads its settings
+    from the `<NAMESPACE>_METRICS_PORT` and `<NAMESPACE>_METRICS_REPORT`
+    environment variables.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._started = False
+        self._lock = threading.Lock()
+        # (name, labels) -> Histogram / count
+        self._histograms = {}
+        self._counters = {}
+        # name -> function returning the cache's stats() dict
+        self._caches = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = Histogram()
+            h.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, **labels):
+        """
+        Time the block into the `stage_seconds` histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    def timed(self, stage: str, **labels):
+        """
+        Decorator timing every call of a function or coroutine function.
+        """
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with self.timer(stage, **labels):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.timer(stage, **labels):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register_cache(self, name: str, stats: Callable[[], dict]):
+        """
+        Report the hits and misses of a cache, `stats` returns a dict with at
+        least "hits" and "misses".
+        """
+        self._caches[name] = stats
+
+    def prometheus(self) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        ns = self.namespace
+        lines = []
+        typed = set()
+
+        def declare(name, type):
+            # every metric is declared once, before its first sample
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {type}")
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            for (name, labels), h in histograms:
+                labels = dict(labels)
+                declare(f"{ns}_{name}", "histogram")
+                cumulative = 0
+                for b, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f"{ns}_{name}_bucket{_labels({**labels, 'le': b})} {cumulative}")
+                lines.append(f"{ns}_{name}_bucket{_labels({**labels, 'le': '+Inf'})} {h.count}")
+                lines.append(f"{ns}_{name}_sum{_labels(labels)} {h.sum}")
+                lines.append(f"{ns}_{name}_count{_labels(labels)} {h.count}")
+        for (name, labels), value in counters:
+            declare(f"{ns}_{name}", "counter")
+            lines.append(f"{ns}_{name}{_labels(dict(labels))} {value}")
+        for cache, stats in sorted(self._caches.items()):
+            s = stats()
+            for k in ("hits", "misses"):
+                declare(f"{ns}_cache_{k}_total", "counter")
+                lines.append(f"{ns}_cache_{k}_total{_labels({'cache': cache})} {s.get(k, 0)}")
+            if "size" in s:
+                declare(f"{ns}_cache_size", "gauge")
+                lines.append(f"{ns}_cache_size{_labels({'cache': cache})} {s['size']}")
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> dict:
+        """
+        Return a summary of all metrics, with percentiles for every histogram.
+        """
+        def key(name, labels):
+            return name + _labels(dict(labels))
+
+        with self._lock:
+            out = {
+                "histograms": {key(*k): h.summary() for k, h in sorted(self._histograms.items())},
+                "counters": {key(*k): v for k, v in sorted(self._counters.items())},
+            }
+        caches = {}
+        for cache, stats in sorted(self._caches.items()):
+            s = dict(stats())
+            total = s.get("hits", 0) + s.get("misses", 0)
+            s.setdefault("hit_rate", s.get("hits", 0) / total if total else 0.0)
+            caches[cache] = s
+        out["caches"] = caches
+        return out
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+        """
+        Serve the metrics at /metrics and the report at /report from a background thread.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, ctype = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/report":
+                    body, ctype = json.dumps(metrics.report()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+    def setup(self):
+        """
+        Start serving and reporting metrics as configured by the environment, once.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        prefix = self.namespace.upper()
+        if port := os.environ.get(f"{prefix}_METRICS_PORT"):
+            self.serve(int(port))
+        if path := os.environ.get(f"{prefix}_METRICS_REPORT"):
+            atexit.register(self.write_report, path)
+
+
+METRICS = Metrics("stormy")
+
+observe = METRICS.observe
+inc = METRICS.inc
+timer = METRICS.timer
+timed = METRICS.timed
+register_cache = METRICS.register_cache
+setup = METRICS.setup
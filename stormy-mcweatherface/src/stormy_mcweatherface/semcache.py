@@ -0,0 +1,197 @@
+"""
+Semantic cache of agent responses.
+
+Many questions are asked again and again with small variations, "weather in
+Oslo" and "What's the weather like in Oslo?" deserve the same answer as long
+as the forecast has not changed. Questions are embedded as hashed character
+n-grams, which needs no model and takes microseconds, and a cached response is
+served when a cached question is similar enough and names exactly the same
+things. Similar is not good enough for places and days: "Vestre Toten" is not
+"Østre Toten" and Saturday is not Sunday, so all words other than the filler
+of a question have to match.
+
+Every response expires, typically when the forecasts it is based on expire,
+and the least recently used responses are evicted when the cache is full.
+Responses are kept in a SQLite database so they survive restarts.
+"""
+import collections
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from .geocache import CACHE_DIR, normalize
+
+
+# number of dimensions of the question embeddings
+DIM = 512
+
+# words that can differ between two questions with the same answer
+FILLER = frozenset(
+    "a about an any are at be can could do does for forecast going how i in is it like "
+    "me of on please s tell the to weather what whats will would you".split()
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    query TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    expires REAL NOT NULL,
+    used REAL NOT NULL
+);
+"""
+
+
+def embed(text: str, dim: int = DIM) -> np.ndarray:
+    """
+    Embed the text as normalized counts of hashed character 3-grams and words.
+    """
+    text = normalize(text)
+    v = np.zeros(dim, dtype=np.float32)
+    padded = f" {text} "
+    grams = [padded[i : i + 3] for i in range(len(padded) - 2)] + text.split()
+    for g in grams:
+        h = int.from_bytes(hashlib.blake2b(g.encode(), digest_size=4).digest(), "little")
+        v[h % dim] += 1.0
+    n = np.linalg.norm(v)
+    return v / n if n else v
+
+
+def entities(text: str) -> frozenset[str]:
+    """
+    Return the words of the normalized text that are not filler, the places,
+    days, times and numbers a question is about.
+    """
+    return frozenset(w for w in text.split() if w not in FILLER)
+
+
+class SemanticCache:
+    """
+    Similarity matched response cache, safe to share between threads.
+
+    Apart from filler words the questions have to match exactly, "Storgata 3"
+    is not "Storgata 5" and "Bergen on Saturday" is not "Bergen on Sunday"
+    however similar the rest of the question is.
+    """
+
+    def __init__(
+        self,
+        path=CACHE_DIR / "responses.sqlite",
+        threshold: float = 0.9,
+        maxsize: int = 5000,
+        dim: int = DIM,
+    ):
+        self.path = None if path is None else pathlib.Path(path)
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        # query -> (embedding, response, expires), least recently used first
+        self._entries = None
+        self._matrix = None
+        self._keys = None
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def entries(self) -> collections.OrderedDict:
+        # load on first use so importing the module does not touch the disk
+        if self._entries is None:
+            self._entries = collections.OrderedDict()
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(SCHEMA)
+                db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+                rows = db.execute(
+                    "SELECT query, response, expires FROM responses ORDER BY used"
+                ).fetchall()
+                for query, response, expires in rows:
+                    self._entries[query] = (embed(query, self.dim), json.loads(response), expires)
+                self._db = db
+        return self._entries
+
+    def _search(self, key: str) -> Optional[str]:
+        entries = self.entries
+        if key in entries:
+            return key
+        if not entries:
+            return None
+        if self._matrix is None:
+            self._keys = list(entries)
+            self._matrix = np.stack([entries[k][0] for k in self._keys])
+        scores = self._matrix @ embed(key, self.dim)
+        words = entities(key)
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                break
+            if entities(self._keys[i]) == words:
+                return self._keys[i]
+        return None
+
+    def _drop(self, key: str):
+        del self._entries[key]
+        self._matrix = None
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE query = ?", (key,))
+
+    def get(self, query: str) -> Optional[Any]:
+        """
+        Return the response to the most similar cached question, if there is
+        one similar enough that has not expired.
+        """
+        key = normalize(query)
+        with self._lock:
+            match = self._search(key)
+            if match is not None and self._entries[match][2] < time.time():
+                self._drop(match)
+                match = None
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(match)
+            if self._db is not None:
+                self._db.execute("UPDATE responses SET used = ? WHERE query = ?", (time.time(), match))
+            return self._entries[match][1]
+
+    def put(self, query: str, response: Any, expires: float):
+        """
+        Cache the JSON serializable response to the question until `expires`.
+        """
+        key = normalize(query)
+        with self._lock:
+            entries = self.entries
+            entries[key] = (embed(key, self.dim), response, expires)
+            entries.move_to_end(key)
+            self._matrix = None
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(response, ensure_ascii=False), expires, time.time()),
+                )
+            while len(entries) > self.maxsize:
+                self._drop(next(iter(entries)))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._matrix = None
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries or ()),
+        }
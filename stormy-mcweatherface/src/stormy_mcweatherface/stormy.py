@@ -1,5 +1,11 @@
+import contextlib
+import contextvars
 import json
-from typing import Any, Callable, Generator, Optional, Dict
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Generator, Optional, Dict
 import os
 import sys
 from uuid import uuid4
@@ -19,101 +25,68 @@ from mlflow.types.responses import (
 from pydantic import BaseModel
 
 import databricks.sdk
+import databricks.sdk.config
 #from stormy_mcweatherface import get_geocode_location, get_weather
 
+from . import clients, metrics
+from .semcache import SemanticCache
+# the tools get_geocode_location and get_weather used to be defined here, and
+# are re-exported for code that imports them from this module
+from .weather import FORECAST_CACHE, GEOCODE_CACHE, get_geocode_location, get_weather, get_weather_summary
 
-async def get_geocode_location(query: str, limit: int = 1) -> Optional[Dict[str, Any]]:
+RESPONSE_CACHE = SemanticCache()
+
+metrics.register_cache("response", RESPONSE_CACHE.stats)
+
+# how long to cache responses that do not depend on a forecast
+RESPONSE_TTL = 3600
+
+
+# tools run by the planner
+PLANNED_TOOLS = {"get_geocode_location", "get_weather"}
+
+# when the weather is asked for, like "tomorrow", "on Saturday" or "at 3pm"
+_DAY = r"(?:mon|tues|wednes|thurs|fri|satur|sun)day"
+_PART = r"(?:morning|afternoon|evening|night)"
+WHEN = (
+    rf"(?:(?:right )?now|today|tonight|later(?: today)?|tomorrow(?: {_PART})?"
+    rf"|(?:this|next) (?:{_PART}|week|weekend|{_DAY})|(?:on |this |next )?{_DAY}(?: {_PART})?"
+    rf"|(?:in the|at) {_PART}|(?:over )?the weekend|in \d+ (?:hours?|days?)"
+    r"|on (?:the )?\d{1,2}(?:st|nd|rd|th)?(?: of \w+)?|on \d{4}-\d{2}-\d{2}"
+    r"|at \d{1,2}(?::\d{2})?\s*(?:am|pm)?)"
+)
+
+# plain weather requests for one location, like "What is the weather like in
+# Oslo?" or "weather in Bergen on Saturday"
+WEATHER_REQUEST = re.compile(
+    r"^\s*(?:what(?:'s| is| will) the weather(?: be)?(?: like)?|how(?:'s| is| will) the weather(?: be)?|weather)"
+    rf"(?:\s+(?P<before>{WHEN}(?:\s+{WHEN})*))?"
+    r"\s+(?:in|at|for)\s+(?P<location>[^?!]+?)"
+    rf"(?:\s+(?P<when>{WHEN}(?:\s+{WHEN})*))?\s*[?.!]*\s*$",
+    re.IGNORECASE,
+)
+
+MULTIPLE_LOCATIONS = re.compile(r"\b(?:and|or|og|eller)\b|[&;]", re.IGNORECASE)
+
+
+def weather_request(query: str) -> Optional[re.Match]:
     """
-    Geocode a location using the Nominatim API.
-    
-    Args:
-        query: The location to search for (e.g., "Paris, France")
-        limit: Maximum number of results to return (default: 1)
-    
-    Returns:
-        Dictionary containing the geocoding result or None if not found
+    Return the match if the query is a plain weather request for a single
+    location, with the location and when the weather is asked for, if said.
     """
-    base_url = "https://nominatim.openstreetmap.org/search"
-    
-    params = {
-        "q": query,
-        "format": "json",
-        "limit": limit,
-        "addressdetails": 1
-    }
-    
-    headers = {
-        "User-Agent": "stormy-mcweatherface/0.1.0"
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(base_url, params=params, headers=headers)
-            response.raise_for_status()
-            
-            results = response.json()
-            if results:
-                return {
-                "success": True,
-                "location": results[0].get('display_name', query),
-                "latitude": float(results[0]['lat']),
-                "longitude": float(results[0]['lon'])
-            } 
-
-            #return results[0] if results else None
-            else:
-                return {
-                    "success": False,
-                    "error": f"Could not find coordinates for location: {query}"
-                }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"Error geocoding location: {str(e)}"
-            }
+    m = WEATHER_REQUEST.match(query)
+    # "Oslo and Bergen" is more than one location
+    if m is None or MULTIPLE_LOCATIONS.search(m.group("location")):
+        return None
+    return m
 
 
-
-async def get_weather(lat, lon, user_agent="MyApp/1.0 (oda.johanne.kristensen[at]posten.no)"):
+def weather_location(query: str) -> Optional[str]:
     """
-    Get weather forecast from met.no API
-    
-    Args:
-        lat: Latitude
-        lon: Longitude  
-        user_agent: Your app name and contact info (REQUIRED)
-    
-    Returns:
-        Weather data dictionary or None if failed
+    Return the location if the query is a plain weather request for a single location.
     """
-    # Round coordinates to 4 decimals (API requirement)
-    lat = round(lat, 4)
-    lon = round(lon, 4)
-    
-    url = f"https://api.met.no/weatherapi/locationforecast/2.0/compact?lat={lat}&lon={lon}"
-    
-    headers = {
-        'User-Agent': user_agent
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers)
-        
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 403:
-                print("Error: Invalid User-Agent. Please use your real app name and contact info.")
-            elif response.status_code == 429:
-                print("Error: Too many requests. Please wait before trying again.")
-            else:
-                print(f"Error: HTTP {response.status_code}")
-                
-            return None
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}")
-            return None
+    m = weather_request(query)
+    return m.group("location") if m is not None else None
 
 
 class ToolInfo(BaseModel):
@@ -122,11 +95,143 @@ class ToolInfo(BaseModel):
     - "name" (str): The name of the tool.
     - "spec" (dict): JSON description of the tool (matches OpenAI Responses format)
     - "exec_fn" (Callable): Function that implements the tool logic
+    - "async_fn" (Callable, optional): Coroutine function that implements the
+      tool logic, awaited by the async agent instead of running `exec_fn` in a thread
     """
 
     name: str
     spec: dict
     exec_fn: Callable
+    async_fn: Optional[Callable] = None
+
+
+class DatabricksAuth(httpx.Auth):
+    """
+    Authenticates requests with the credentials of a Databricks workspace.
+    """
+
+    def __init__(self, config: databricks.sdk.config.Config):
+        self.config = config
+
+    def auth_flow(self, request: httpx.Request):
+        request.headers.update(self.config.authenticate())
+        yield request
+
+
+def create_async_client(wc: Optional[databricks.sdk.WorkspaceClient] = None) -> openai.AsyncOpenAI:
+    """
+    Create an async OpenAI client for the serving endpoints of a Databricks workspace.
+    """
+    wc = wc or databricks.sdk.WorkspaceClient()
+    return openai.AsyncOpenAI(
+        base_url=f"{wc.config.host}/serving-endpoints",
+        # the token is set per request by DatabricksAuth
+        api_key="no-token",
+        http_client=httpx.AsyncClient(auth=DatabricksAuth(wc.config), timeout=clients.TIMEOUT),
+    )
+
+
+class StreamAssembler:
+    """
+    Turns streamed chat completion chunks into Responses stream events.
+
+    Text is passed on as `response.output_text.delta` events as it arrives and
+    tool call arguments as `response.function_call_arguments.delta` events.
+    Once the response is complete `done` returns one
+    `response.output_item.done` event per requested tool call, or a single
+    message if no tools were requested.
+    """
+
+    def __init__(self):
+        self.message_id = str(uuid4())
+        self.text = []
+        # tool calls are streamed in pieces, keyed by their index
+        self.tool_calls = {}
+        # token usage, sent in the last chunk
+        self.usage = None
+        self.start = time.perf_counter()
+        self.first_token = None
+
+    def add(self, chunk) -> list[ResponsesAgentStreamEvent]:
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return []
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+        events = []
+        delta = chunk.choices[0].delta
+        if delta.content:
+            self.text.append(delta.content)
+            events.append(ResponsesAgentStreamEvent(
+                type="response.output_text.delta",
+                item_id=self.message_id,
+                delta=delta.content,
+            ))
+        for tc in delta.tool_calls or []:
+            call = self.tool_calls.setdefault(tc.index, {
+                "id": str(uuid4()),
+                "call_id": None,
+                "name": "",
+                "arguments": [],
+            })
+            if tc.id:
+                call["call_id"] = tc.id
+            if tc.function is None:
+                continue
+            if tc.function.name:
+                call["name"] += tc.function.name
+            if tc.function.arguments:
+                call["arguments"].append(tc.function.arguments)
+                events.append(ResponsesAgentStreamEvent(
+                    type="response.function_call_arguments.delta",
+                    item_id=call["id"],
+                    output_index=tc.index,
+                    delta=tc.function.arguments,
+                ))
+        return events
+
+    def record(self):
+        """
+        Record the latency and token usage of the completion.
+        """
+        metrics.observe("stage_seconds", time.perf_counter() - self.start, stage="llm")
+        if self.first_token is not None:
+            metrics.observe("stage_seconds", self.first_token, stage="llm_first_token")
+        if self.usage is not None:
+            metrics.inc("tokens_total", self.usage.prompt_tokens or 0, kind="prompt")
+            metrics.inc("tokens_total", self.usage.completion_tokens or 0, kind="completion")
+
+    def done(self) -> list[ResponsesAgentStreamEvent]:
+        self.record()
+        content = "".join(self.text)
+        if not self.tool_calls:
+            return [ResponsesAgentStreamEvent(
+                type="response.output_item.done",
+                item={
+                    "id": self.message_id,
+                    "content": [{"type": "output_text", "text": content}],
+                    "role": "assistant",
+                    "type": "message",
+                },
+            )]
+        events = []
+        for i, index in enumerate(sorted(self.tool_calls)):
+            call = self.tool_calls[index]
+            events.append(ResponsesAgentStreamEvent(
+                type="response.output_item.done",
+                item={
+                    "id": call["id"],
+                    "type": "function_call",
+                    "name": call["name"],
+                    "call_id": call["call_id"] or call["id"],
+                    "arguments": "".join(call["arguments"]),
+                    "role": "assistant",
+                    # any text goes with the first call
+                    "content": content if i == 0 else "",
+                },
+            ))
+        return events
 
 
 class ToolCallingAgent(ResponsesAgent):
@@ -134,13 +239,50 @@ class ToolCallingAgent(ResponsesAgent):
     Class representing a tool-calling Agent
     """
 
-    def __init__(self, model: str, tools: list[ToolInfo]):
-        """Initializes the ToolCallingAgent with tools."""
+    def __init__(
+        self,
+        model: str,
+        tools: list[ToolInfo],
+        max_tool_workers: int = 8,
+        client=None,
+        async_client=None,
+        planner: bool = False,
+        cache: Optional[SemanticCache] = None,
+    ):
+        """
+        Initializes the ToolCallingAgent with tools.
+
+        Pass an OpenAI `client` to share it, and its connection pool, between
+        agents, otherwise one is created for the Databricks workspace. The
+        `async_client` used by `apredict` and `apredict_stream` is created on
+        first use if not given.
+
+        With `planner` set, plain weather requests for a single location run
+        the geocode and weather tools directly, see `plan`.
+
+        With a `cache`, responses to single questions are cached until the
+        forecasts they are based on expire, and similar questions are answered
+        from the cache without calling the LLM or the tools.
+        """
         self.model = model
+        self.planner = planner
+        self.cache = cache
         self._tools_dict = {tool.name: tool for tool in tools}
+        # runs the tool calls of a single LLM turn in parallel
+        self._executor = ThreadPoolExecutor(max_workers=max_tool_workers)
         
-        self.wc = databricks.sdk.WorkspaceClient()
-        self.client = self.wc.serving_endpoints.get_open_ai_client()
+        self.wc = None
+        if client is None:
+            self.wc = databricks.sdk.WorkspaceClient()
+            client = self.wc.serving_endpoints.get_open_ai_client()
+        self.client = client
+        self._async_client = async_client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = create_async_client(self.wc)
+        return self._async_client
 
     def get_tool_specs(self) -> list[dict]:
         """Returns tool specifications in the format OpenAI expects."""
@@ -149,43 +291,89 @@ class ToolCallingAgent(ResponsesAgent):
     @mlflow.trace(span_type=SpanType.TOOL)
     def execute_tool(self, tool_name: str, args: dict) -> Any:
         """Executes the specified tool with the given arguments."""
-        return self._tools_dict[tool_name].exec_fn(**args)
+        with metrics.timer("tool", tool=tool_name):
+            return self._tools_dict[tool_name].exec_fn(**args)
+
+    @staticmethod
+    def to_chat_messages(input_messages) -> list[dict]:
+        """
+        Convert Responses items to chat completion messages.
+
+        Consecutive function calls become a single assistant message with
+        several tool calls, followed by one tool message per output, which is
+        what the chat completions API expects for parallel tool calls.
+        """
+        messages = []
+        for msg in input_messages:
+            type = msg.get("type", None)
+            if type == "function_call":
+                tool_call = {
+                    "id": msg["call_id"],
+                    "type": "function",
+                    "function": {"name": msg["name"], "arguments": msg["arguments"]},
+                }
+                last = messages[-1] if messages else {}
+                if last.get("role") == "assistant" and "tool_calls" in last:
+                    last["tool_calls"].append(tool_call)
+                else:
+                    messages.append({
+                        "role": "assistant",
+                        "content": msg.get("content") or None,
+                        "tool_calls": [tool_call],
+                    })
+            elif type == "function_call_output":
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": msg["call_id"],
+                    "content": msg["output"],
+                })
+            elif type == "message" and msg.get("role") == "assistant":
+                text = "".join(c.get("text", "") for c in msg["content"])
+                messages.append({"role": "assistant", "content": text})
+            else:
+                messages.append({"role": msg["role"], "content": msg["content"]})
+        return messages
 
     @backoff.on_exception(backoff.expo, openai.RateLimitError)
-    @mlflow.trace(span_type=SpanType.LLM)
-    def call_llm(self, input_messages) -> ResponsesAgentStreamEvent:
-        response = self.client.chat.completions.create(
+    def create_completion(self, input_messages):
+        """
+        Start a streaming chat completion, retrying if rate limited.
+        """
+        return self.client.chat.completions.create(
             model=self.model,
-            messages=input_messages,
+            messages=self.to_chat_messages(input_messages),
             tools=self.get_tool_specs(),
-            temperature=1.2
+            temperature=1.2,
+            stream=True,
+            # token counts for the metrics
+            stream_options={"include_usage": True},
         )
-        
-        message = response.choices[0].message
-        if message.tool_calls:
-            return {
-                "id": str(uuid4()),
-                "type": "function_call",
-                "name": message.tool_calls[0].function.name,
-                "call_id": message.tool_calls[0].id,
-                "arguments": message.tool_calls[0].function.arguments,
-                "role": "assistant",
-                "content": message.content or "",
-            }
-        else:
-            return {
-                "id": str(uuid4()),
-                "content": [{"type": "output_text", "text": message.content}],
-                "role": "assistant",
-                "type": "message",
-            }
+
+    @mlflow.trace(span_type=SpanType.LLM)
+    def call_llm(self, input_messages) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        """
+        Stream the LLM response as Responses stream events, see `StreamAssembler`.
+        """
+        stream = StreamAssembler()
+        for chunk in self.create_completion(input_messages):
+            yield from stream.add(chunk)
+        yield from stream.done()
 
     def handle_tool_call(self, tool_call: dict[str, Any]) -> ResponsesAgentStreamEvent:
         """
         Execute tool calls and return a ResponsesAgentStreamEvent w/ tool output
         """
         args = json.loads(tool_call["arguments"])
-        result = str(self.execute_tool(tool_name=tool_call["name"], args=args))
+        result = self.execute_tool(tool_name=tool_call["name"], args=args)
+        return self.tool_output_event(tool_call, result)
+
+    @staticmethod
+    def tool_output_event(tool_call: dict[str, Any], result: Any) -> ResponsesAgentStreamEvent:
+        """
+        Return the ResponsesAgentStreamEvent w/ the output of a tool call
+        """
+        if not isinstance(result, str):
+            result = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
 
         tool_call_output = {
             "type": "function_call_output",
@@ -199,6 +387,20 @@ class ToolCallingAgent(ResponsesAgent):
             type="response.output_item.done", item=tool_call_output
         )
 
+    def handle_tool_calls(self, tool_calls: list[dict[str, Any]]) -> list[ResponsesAgentStreamEvent]:
+        """
+        Execute tool calls concurrently and return their outputs in call order.
+        """
+        if len(tool_calls) == 1:
+            return [self.handle_tool_call(tool_calls[0])]
+        # run each call in a copy of the current context so the tool spans
+        # end up in the same trace
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self.handle_tool_call, tool_call)
+            for tool_call in tool_calls
+        ]
+        return [f.result() for f in futures]
+
     def call_and_run_tools(
         self,
         input_messages,
@@ -212,16 +414,20 @@ class ToolCallingAgent(ResponsesAgent):
             ):
                 return
             if last_msg.get("type", None) == "function_call":
-                tool_call_res = self.handle_tool_call(last_msg)
-                input_messages.append(tool_call_res.item)
-                yield tool_call_res
+                # all tool calls from the last LLM turn
+                tool_calls = []
+                for msg in reversed(input_messages):
+                    if msg.get("type", None) != "function_call":
+                        break
+                    tool_calls.insert(0, msg)
+                for tool_call_res in self.handle_tool_calls(tool_calls):
+                    input_messages.append(tool_call_res.item)
+                    yield tool_call_res
             else:
-                llm_output = self.call_llm(input_messages=input_messages)
-                input_messages.append(llm_output)
-                yield ResponsesAgentStreamEvent(
-                    type="response.output_item.done",
-                    item=llm_output,
-                )
+                for event in self.call_llm(input_messages=input_messages):
+                    if event.type == "response.output_item.done":
+                        input_messages.append(event.item)
+                    yield event
 
         yield ResponsesAgentStreamEvent(
             type="response.output_item.done",
@@ -249,6 +455,146 @@ class ToolCallingAgent(ResponsesAgent):
             output=outputs, custom_outputs=request.custom_inputs
         )
 
+    def plan(self, input_messages) -> Optional[str]:
+        """
+        Return the location if the conversation is a plain weather request for
+        a single location, which always takes the same tool calls.
+
+        Anything else, including follow up questions, returns None and is left
+        to the LLM.
+        """
+        if not self.planner or not PLANNED_TOOLS <= self._tools_dict.keys():
+            return None
+        query = self.user_query(input_messages)
+        return None if query is None else weather_location(query)
+
+    @staticmethod
+    def user_query(input_messages) -> Optional[str]:
+        """
+        Return the question if the conversation is a single user message.
+        """
+        user = [m for m in input_messages if m.get("role") != "system"]
+        if len(user) != 1 or user[0].get("role") != "user":
+            return None
+        content = user[0].get("content")
+        if isinstance(content, list):
+            content = " ".join(c.get("text", "") for c in content if isinstance(c, dict))
+        return content if isinstance(content, str) else None
+
+    def cached_query(self, input_messages) -> Optional[str]:
+        """
+        Return the key the response to the conversation is cached under, if it
+        can be cached at all.
+        """
+        if self.cache is None:
+            return None
+        query = self.user_query(input_messages)
+        if query is None:
+            return None
+        # all the ways of asking for the weather in a place now are the same
+        # question, asking about a given day or time is not
+        m = weather_request(query)
+        if m is None or m.group("before") or m.group("when"):
+            return query
+        # once the place has been geocoded, key on where it is rather than
+        # its name, places with similar names are not the same place
+        location = GEOCODE_CACHE.get(m.group("location"))
+        if location is None:
+            return f"weather in {m.group('location')}"
+        return f"weather at {location['latitude']} {location['longitude']}"
+
+    @staticmethod
+    def response_expires(outputs: list[dict[str, Any]]) -> Optional[float]:
+        """
+        Return until when the response is valid, which is when the first of
+        the forecasts it is based on expires. Responses to failed tool calls
+        are not cached.
+        """
+        if not outputs or outputs[-1].get("type") != "message":
+            return None
+        expires = time.time() + RESPONSE_TTL
+        for item in outputs:
+            if item.get("type") == "function_call_output" and '"success":false' in item.get("output", ""):
+                return None
+            if item.get("type") == "function_call" and item.get("name") == "get_weather":
+                try:
+                    args = json.loads(item["arguments"])
+                    forecast = FORECAST_CACHE.expires(float(args["lat"]), float(args["lon"]))
+                except (KeyError, TypeError, ValueError):
+                    return None
+                if forecast is None:
+                    return None
+                expires = min(expires, forecast)
+        return expires
+
+    def remember(self, input_messages, outputs: list[dict[str, Any]]):
+        expires = self.response_expires(outputs)
+        if expires is not None and expires > time.time():
+            # the location may have been geocoded while answering, which
+            # changes the key
+            self.cache.put(self.cached_query(input_messages), outputs, expires)
+
+    @staticmethod
+    def replay(outputs: list[dict[str, Any]]) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        """
+        Yield the events of a cached response.
+        """
+        for item in outputs:
+            if item.get("type") == "message":
+                for c in item["content"]:
+                    yield ResponsesAgentStreamEvent(
+                        type="response.output_text.delta", item_id=item["id"], delta=c.get("text", "")
+                    )
+            yield ResponsesAgentStreamEvent(type="response.output_item.done", item=item)
+
+    @staticmethod
+    def planned_call(name: str, args: dict) -> dict[str, Any]:
+        """
+        Return a function call item for a tool call made without the LLM.
+        """
+        return {
+            "id": str(uuid4()),
+            "type": "function_call",
+            "name": name,
+            "call_id": f"call_{uuid4().hex[:24]}",
+            "arguments": json.dumps(args),
+            "role": "assistant",
+            "content": "",
+        }
+
+    @staticmethod
+    def planned_coordinates(output: dict[str, Any]) -> Optional[dict]:
+        # arguments for get_weather, if geocoding succeeded
+        try:
+            result = json.loads(output["output"])
+        except ValueError:
+            return None
+        if not isinstance(result, dict) or not result.get("success"):
+            return None
+        return {"lat": str(result["latitude"]), "lon": str(result["longitude"])}
+
+    @mlflow.trace(span_type=SpanType.CHAIN)
+    def run_plan(self, input_messages, location: str) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        """
+        Geocode the location and get its weather without asking the LLM,
+        adding the calls and their outputs to the conversation as if the LLM
+        had requested them.
+
+        If geocoding fails the conversation is left for the LLM to handle.
+        """
+        args = {"location": location}
+        for name in ("get_geocode_location", "get_weather"):
+            if args is None:
+                return
+            call = self.planned_call(name, args)
+            input_messages.append(call)
+            yield ResponsesAgentStreamEvent(type="response.output_item.done", item=call)
+            output = self.handle_tool_call(call)
+            input_messages.append(output.item)
+            yield output
+            if name == "get_geocode_location":
+                args = self.planned_coordinates(output.item)
+
     @mlflow.trace(span_type=SpanType.AGENT)
     def predict_stream(
         self, request: ResponsesAgentRequest
@@ -256,8 +602,167 @@ class ToolCallingAgent(ResponsesAgent):
         input_messages = [{"role": "system", "content": SYSTEM_PROMPT}] + [
             i.model_dump() for i in request.input
         ]
+        query = self.cached_query(input_messages)
+        if query is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                yield from self.replay(cached)
+                return
+
+        outputs = []
+        for event in self.run(input_messages):
+            if event.type == "response.output_item.done":
+                outputs.append(event.item)
+            yield event
+        if query is not None:
+            self.remember(input_messages, outputs)
+
+    def run(self, input_messages) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        location = self.plan(input_messages)
+        if location is not None:
+            yield from self.run_plan(input_messages, location)
         yield from self.call_and_run_tools(input_messages=input_messages)
 
+    # async variants, for serving many conversations on a single event loop
+
+    @backoff.on_exception(backoff.expo, openai.RateLimitError)
+    async def acreate_completion(self, input_messages):
+        """
+        Start a streaming chat completion with the async client, retrying if rate limited.
+        """
+        return await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self.to_chat_messages(input_messages),
+            tools=self.get_tool_specs(),
+            temperature=1.2,
+            stream=True,
+            # token counts for the metrics
+            stream_options={"include_usage": True},
+        )
+
+    @mlflow.trace(span_type=SpanType.LLM)
+    async def acall_llm(self, input_messages) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        stream = StreamAssembler()
+        async for chunk in await self.acreate_completion(input_messages):
+            for event in stream.add(chunk):
+                yield event
+        for event in stream.done():
+            yield event
+
+    @mlflow.trace(span_type=SpanType.TOOL)
+    async def aexecute_tool(self, tool_name: str, args: dict) -> Any:
+        """Awaits the specified tool, running it in a thread if it is not async."""
+        tool = self._tools_dict[tool_name]
+        with metrics.timer("tool", tool=tool_name):
+            if tool.async_fn is not None:
+                return await tool.async_fn(**args)
+            return await asyncio.to_thread(tool.exec_fn, **args)
+
+    async def ahandle_tool_call(self, tool_call: dict[str, Any]) -> ResponsesAgentStreamEvent:
+        args = json.loads(tool_call["arguments"])
+        result = await self.aexecute_tool(tool_name=tool_call["name"], args=args)
+        return self.tool_output_event(tool_call, result)
+
+    @mlflow.trace(span_type=SpanType.CHAIN)
+    async def arun_plan(self, input_messages, location: str) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        args = {"location": location}
+        for name in ("get_geocode_location", "get_weather"):
+            if args is None:
+                return
+            call = self.planned_call(name, args)
+            input_messages.append(call)
+            yield ResponsesAgentStreamEvent(type="response.output_item.done", item=call)
+            output = await self.ahandle_tool_call(call)
+            input_messages.append(output.item)
+            yield output
+            if name == "get_geocode_location":
+                args = self.planned_coordinates(output.item)
+
+    async def acall_and_run_tools(
+        self,
+        input_messages,
+        max_iter: int = 10,
+    ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        for _ in range(max_iter):
+            last_msg = input_messages[-1]
+            if (
+                last_msg.get("type", None) == "message"
+                and last_msg.get("role", None) == "assistant"
+            ):
+                return
+            if last_msg.get("type", None) == "function_call":
+                tool_calls = []
+                for msg in reversed(input_messages):
+                    if msg.get("type", None) != "function_call":
+                        break
+                    tool_calls.insert(0, msg)
+                results = await asyncio.gather(*(self.ahandle_tool_call(tc) for tc in tool_calls))
+                for tool_call_res in results:
+                    input_messages.append(tool_call_res.item)
+                    yield tool_call_res
+            else:
+                async for event in self.acall_llm(input_messages=input_messages):
+                    if event.type == "response.output_item.done":
+                        input_messages.append(event.item)
+                    yield event
+
+        yield ResponsesAgentStreamEvent(
+            type="response.output_item.done",
+            item={
+                "id": str(uuid4()),
+                "content": [
+                    {
+                        "type": "output_text",
+                        "text": "Max iterations reached. Stopping.",
+                    }
+                ],
+                "role": "assistant",
+                "type": "message",
+            },
+        )
+
+    @mlflow.trace(span_type=SpanType.AGENT)
+    async def apredict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+        outputs = [
+            event.item
+            async for event in self.apredict_stream(request)
+            if event.type == "response.output_item.done"
+        ]
+        return ResponsesAgentResponse(
+            output=outputs, custom_outputs=request.custom_inputs
+        )
+
+    @mlflow.trace(span_type=SpanType.AGENT)
+    async def apredict_stream(
+        self, request: ResponsesAgentRequest
+    ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        input_messages = [{"role": "system", "content": SYSTEM_PROMPT}] + [
+            i.model_dump() for i in request.input
+        ]
+        query = self.cached_query(input_messages)
+        if query is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                for event in self.replay(cached):
+                    yield event
+                return
+
+        outputs = []
+        async for event in self.arun(input_messages):
+            if event.type == "response.output_item.done":
+                outputs.append(event.item)
+            yield event
+        if query is not None:
+            self.remember(input_messages, outputs)
+
+    async def arun(self, input_messages) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        location = self.plan(input_messages)
+        if location is not None:
+            async for event in self.arun_plan(input_messages, location):
+                yield event
+        async for event in self.acall_and_run_tools(input_messages=input_messages):
+            yield event
+
 
 # Tool implementation for getting GPS coordinates
 
@@ -282,7 +787,8 @@ tools = [
             }},
             "strict": True,
         },
-        exec_fn=lambda location: asyncio.run(get_geocode_location(location))
+        exec_fn=lambda location: clients.run(get_geocode_location(location)),
+        async_fn=lambda location: get_geocode_location(location),
     ), 
     ToolInfo(
         name="get_weather",
@@ -290,7 +796,7 @@ tools = [
             "type": "function",
             "function": {
                 "name": "get_weather",
-                "description": "Get current weather information for a given location.",
+                "description": "Get current weather, an hourly forecast for the next hours and a daily forecast for the next days for a given location. Times are in UTC.",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -309,18 +815,66 @@ tools = [
             },
             "strict": True,
         },
-        exec_fn=lambda lat, lon: asyncio.run(get_weather(float(lat), float(lon)))
+        exec_fn=lambda lat, lon: clients.run(get_weather_summary(float(lat), float(lon))),
+        async_fn=lambda lat, lon: get_weather_summary(float(lat), float(lon)),
     )
 ]
 
-SYSTEM_PROMPT = "You are Stormy McWeatherface, a helpful location assistant. When users provides a location, use the get_location_coordinates tool to find the GPS coordinates, and then send those coordinates to get_location_weather, and present the current weather for the requested location, together with the locations gps coordinates, in a friendly, conversational way. Give suggestions of activities that will suit the current weather conditions"
+SYSTEM_PROMPT = "You are Stormy McWeatherface, a helpful location assistant. When users provides a location, use the get_location_coordinates tool to find the GPS coordinates, and then send those coordinates to get_location_weather, and present the current weather for the requested location, together with the locations gps coordinates, in a friendly, conversational way. Give suggestions of activities that will suit the current weather conditions. When asked about several locations, request the tool calls for all of them at once instead of one location at a time."
 
 
-def create_agent(tools=tools) -> "ToolCallingAgent":
+def create_agent(
+    tools=tools, client=None, planner: bool = False, cache: Optional[SemanticCache] = None
+) -> "ToolCallingAgent":
     """
     Create and return the Stormy McWeatherface agent.
+
+    Set `planner` to run plain weather requests without asking the LLM for
+    the tool calls, see `ToolCallingAgent.plan`, and pass a `cache`, like
+    RESPONSE_CACHE, to answer repeated questions from it.
     
     Returns:
         ToolCallingAgent: The initialized agent with tools for geocoding and weather.
     """
-    return ToolCallingAgent(model="data-science-gpt-4o", tools=tools)
\ No newline at end of file
+    return ToolCallingAgent(
+        model="data-science-gpt-4o", tools=tools, client=client, planner=planner, cache=cache
+    )
+
+
+def create_client():
+    """
+    Create an OpenAI client for the Databricks workspace.
+    """
+    return databricks.sdk.WorkspaceClient().serving_endpoints.get_open_ai_client()
+
+
+class AgentPool:
+    """
+    Fixed size pool of agents, shared between threads.
+
+    The agents are created up front and share one OpenAI client, so resolving
+    the Databricks config and authenticating happens once rather than per
+    request. Borrowing an agent blocks while all of them are in use:
+
+        with pool.agent() as agent:
+            agent.predict(request)
+
+    Other keyword arguments are passed on to `create_agent`.
+    """
+
+    def __init__(self, size: int, tools=tools, client=None, **kwargs):
+        client = client or create_client()
+        self.size = size
+        self._agents = queue.Queue()
+        for _ in range(size):
+            self._agents.put(create_agent(tools=tools, client=client, **kwargs))
+
+    @contextlib.contextmanager
+    def agent(self, timeout: Optional[float] = None):
+        start = time.perf_counter()
+        agent = self._agents.get(timeout=timeout)
+        metrics.observe("queue_wait_seconds", time.perf_counter() - start, queue="agents")
+        try:
+            yield agent
+        finally:
+            self._agents.put(agent)
\ No newline at end of file
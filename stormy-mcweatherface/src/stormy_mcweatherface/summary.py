@@ -0,0 +1,157 @@
+"""
+Compact summaries of met.no forecasts.
+
+A raw locationforecast response holds close to a hundred time steps with a
+dozen values each, tens of kilobytes once stringified, while answering a
+weather question needs the current conditions and a short outlook. `summarize`
+reduces a forecast to a small JSON friendly dict:
+
+- "current": conditions right now
+- "hourly": the next hours
+- "daily": min/max temperature, precipitation sum, max wind and the most
+  common weather symbol per day
+
+All times are UTC, as in the met.no response.
+"""
+import collections
+import datetime
+import math
+from array import array
+from typing import Any, Dict
+
+
+def _symbol(entry: dict, period: str):
+    return entry.get(period, {}).get("summary", {}).get("symbol_code")
+
+
+def _base_symbol(symbol: str) -> str:
+    # "partlycloudy_day" and "partlycloudy_night" are the same weather
+    return symbol.split("_")[0]
+
+
+def _round(x: float, n: int = 1):
+    return None if math.isnan(x) else round(x, n)
+
+
+class Forecast:
+    """
+    Column oriented view of a met.no timeseries.
+
+    Every value is kept in a flat array indexed by time step, missing values
+    are NaN. Precipitation is the amount for the period starting at each time
+    step, which is an hour for the first couple of days and six hours after
+    that, see `period`.
+    """
+
+    FIELDS = {
+        "temperature": "air_temperature",
+        "wind_speed": "wind_speed",
+        "wind_direction": "wind_from_direction",
+        "humidity": "relative_humidity",
+        "cloud_cover": "cloud_area_fraction",
+        "pressure": "air_pressure_at_sea_level",
+    }
+
+    def __init__(self, data: dict):
+        props = data["properties"]
+        self.updated_at = props.get("meta", {}).get("updated_at")
+        lon, lat = data.get("geometry", {}).get("coordinates", [None, None])[:2]
+        self.latitude, self.longitude = lat, lon
+
+        self.times = []
+        self.symbols = []
+        self.values = {k: array("d") for k in self.FIELDS}
+        self.precipitation = array("d")
+        self.period = array("b")
+
+        for entry in props["timeseries"]:
+            self.times.append(datetime.datetime.fromisoformat(entry["time"].replace("Z", "+00:00")))
+            d = entry["data"]
+            details = d["instant"]["details"]
+            for k, name in self.FIELDS.items():
+                self.values[k].append(details.get(name, math.nan))
+
+            # prefer the hourly values, far ahead only six hour values exist
+            for period, hours in (("next_1_hours", 1), ("next_6_hours", 6)):
+                if period in d:
+                    self.precipitation.append(d[period].get("details", {}).get("precipitation_amount", math.nan))
+                    self.period.append(hours)
+                    self.symbols.append(_symbol(d, period))
+                    break
+            else:
+                self.precipitation.append(math.nan)
+                self.period.append(0)
+                self.symbols.append(_symbol(d, "next_12_hours"))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def at(self, i: int) -> Dict[str, Any]:
+        out = {"time": self.times[i].isoformat()}
+        for k in self.FIELDS:
+            out[k] = _round(self.values[k][i])
+        out["precipitation"] = _round(self.precipitation[i])
+        out["symbol"] = self.symbols[i]
+        return out
+
+    def hourly(self, hours: int) -> list[Dict[str, Any]]:
+        out = []
+        for i in range(len(self)):
+            if self.period[i] != 1 or len(out) >= hours:
+                break
+            out.append({
+                "time": self.times[i].isoformat(),
+                "temperature": _round(self.values["temperature"][i]),
+                "wind_speed": _round(self.values["wind_speed"][i]),
+                "precipitation": _round(self.precipitation[i]),
+                "symbol": self.symbols[i],
+            })
+        return out
+
+    def daily(self, days: int) -> list[Dict[str, Any]]:
+        by_day = collections.defaultdict(list)
+        for i, t in enumerate(self.times):
+            by_day[t.date()].append(i)
+
+        out = []
+        for day in sorted(by_day)[:days]:
+            idx = by_day[day]
+            temps = [self.values["temperature"][i] for i in idx if not math.isnan(self.values["temperature"][i])]
+            winds = [self.values["wind_speed"][i] for i in idx if not math.isnan(self.values["wind_speed"][i])]
+            precip = [self.precipitation[i] for i in idx if not math.isnan(self.precipitation[i])]
+            symbols = collections.Counter(_base_symbol(self.symbols[i]) for i in idx if self.symbols[i])
+            out.append({
+                "date": day.isoformat(),
+                "min_temperature": _round(min(temps)) if temps else None,
+                "max_temperature": _round(max(temps)) if temps else None,
+                "precipitation": _round(sum(precip)) if precip else None,
+                "max_wind_speed": _round(max(winds)) if winds else None,
+                "symbol": symbols.most_common(1)[0][0] if symbols else None,
+            })
+        return out
+
+
+def summarize(data: dict, hours: int = 12, days: int = 5) -> Dict[str, Any]:
+    """
+    Reduce a met.no locationforecast response to current conditions, the next
+    `hours` hours and the next `days` days.
+    """
+    f = Forecast(data)
+    return {
+        "success": True,
+        "latitude": f.latitude,
+        "longitude": f.longitude,
+        "updated_at": f.updated_at,
+        "units": {
+            "temperature": "celsius",
+            "wind_speed": "m/s",
+            "wind_direction": "degrees",
+            "humidity": "percent",
+            "cloud_cover": "percent",
+            "pressure": "hPa",
+            "precipitation": "mm",
+        },
+        "current": f.at(0) if len(f) else None,
+        "hourly": f.hourly(hours),
+        "daily": f.daily(days),
+    }
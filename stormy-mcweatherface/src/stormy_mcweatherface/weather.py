@@ -0,0 +1,120 @@
+"""
+Geocoding and weather forecasts, the tools of the agent.
+
+Kept apart from the agent so the batch jobs and anything else that only needs
+the tools start without importing mlflow, openai and the Databricks SDK.
+"""
+from typing import Any, Dict, Optional
+
+from . import clients, metrics, summary
+from .forecast import ForecastCache
+from .geocache import GeocodeCache
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+MET_URL = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
+
+# nominatim allows at most one request per second
+NOMINATIM_LIMITER = clients.RateLimiter(1.0)
+GEOCODE_CACHE = GeocodeCache()
+FORECAST_CACHE = ForecastCache()
+
+metrics.register_cache("geocode", GEOCODE_CACHE.stats)
+metrics.register_cache("forecast", FORECAST_CACHE.stats)
+
+
+async def get_geocode_location(query: str, limit: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    Geocode a location using the Nominatim API.
+    
+    Args:
+        query: The location to search for (e.g., "Paris, France")
+        limit: Maximum number of results to return (default: 1)
+    
+    Returns:
+        Dictionary containing the geocoding result or None if not found
+    """
+    cached = GEOCODE_CACHE.lookup(query)
+    if cached is not None:
+        return cached
+
+    params = {
+        "q": query,
+        "format": "json",
+        "limit": limit,
+        "addressdetails": 1
+    }
+    
+    headers = {
+        "User-Agent": "stormy-mcweatherface/0.1.0"
+    }
+    
+    try:
+        # stay within the usage policy of nominatim
+        await NOMINATIM_LIMITER.wait()
+        response = await clients.get(NOMINATIM_URL, params=params, headers=headers)
+        response.raise_for_status()
+        
+        results = response.json()
+        if results:
+            result = {
+            "success": True,
+            "location": results[0].get('display_name', query),
+            "latitude": float(results[0]['lat']),
+            "longitude": float(results[0]['lon'])
+        } 
+            GEOCODE_CACHE.put(query, result)
+            return result
+
+        #return results[0] if results else None
+        else:
+            return {
+                "success": False,
+                "error": f"Could not find coordinates for location: {query}"
+            }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Error geocoding location: {str(e)}"
+        }
+
+
+
+async def get_weather(lat, lon, user_agent="MyApp/1.0 (oda.johanne.kristensen[at]posten.no)"):
+    """
+    Get weather forecast from met.no API
+    
+    Args:
+        lat: Latitude
+        lon: Longitude  
+        user_agent: Your app name and contact info (REQUIRED)
+    
+    Returns:
+        Weather data dictionary or None if failed
+    """
+    # forecasts are cached per grid cell, and fetched for the cell's
+    # coordinates, which also keeps us within the API's 4 decimals
+    async def fetch(lat, lon, headers):
+        url = f"{MET_URL}?lat={lat}&lon={lon}"
+        return await clients.get(url, headers={'User-Agent': user_agent, **headers})
+
+    return await FORECAST_CACHE.get(lat, lon, fetch)
+
+
+async def get_weather_summary(lat, lon) -> Dict[str, Any]:
+    """
+    Get a compact summary of the weather forecast, see `summary.summarize`.
+
+    Args:
+        lat: Latitude
+        lon: Longitude
+
+    Returns:
+        Dictionary with current conditions and hourly and daily outlooks
+    """
+    data = await get_weather(lat, lon)
+    if data is None:
+        return {
+            "success": False,
+            "error": f"Could not get weather for coordinates: {lat}, {lon}"
+        }
+    return summary.summarize(data)